@@ -1,27 +1,123 @@
+import os
+import threading
+from contextlib import nullcontext
 import numpy as np
 import sounddevice as sd
-import queue
 from collections import deque
-from panns_inference import AudioTagging
+from common.model_runtime import load_audio_tagger
+from common.session_store import SessionStore, RingBuffer, DEFAULT_SESSION
+from common.metrics import metrics
 
 errors = deque(maxlen=500)
 model_path = "./panns_data/Cnn14_mAP=0.431.pth"
 
+# Analysis windows (can also come from environment variables). HOP < WINDOW gives overlapping
+# windows, e.g. 1 s windows every 0.25 s, so speech onset shows up sooner (at HOP/WINDOW more CNN calls).
+AUDIO_WINDOW_SEC = float(os.getenv("AUDIO_WINDOW_SEC", "1.0"))
+AUDIO_HOP_SEC = float(os.getenv("AUDIO_HOP_SEC", "1.0"))
+
+# "mic": host microphone only (single co-located candidate), "network": /ingest only, "both"
+AUDIO_SOURCE = os.getenv("AUDIO_SOURCE", "mic")
+AUDIO_BATCH_MAX = int(os.getenv("AUDIO_BATCH_MAX", "32"))          # windows per Cnn14 forward pass
+AUDIO_RING_WINDOWS = int(os.getenv("AUDIO_RING_WINDOWS", "3"))     # per-session buffer, in windows
+SAMPLE_RATE = 32000  # what Cnn14 expects
+# Accepted rates for network PCM (resampled to SAMPLE_RATE; tiny rates would blow a chunk up in memory)
+PCM_MIN_RATE = 8000
+PCM_MAX_RATE = 192000
+
+# Energy pre-gate: windows quieter than this (RMS, dBFS) count as silence and never reach Cnn14.
+# Lower = more sensitive (more windows go to the CNN). Set AUDIO_VAD=0 to send everything.
+AUDIO_VAD = os.getenv("AUDIO_VAD", "1") == "1"
+AUDIO_VAD_SENSITIVITY_DB = float(os.getenv("AUDIO_VAD_SENSITIVITY", "-50"))
+
+
+class SampleRingBuffer:
+    """
+    Preallocated float32 ring for the raw stream. The sounddevice callback writes straight into it
+    and wakes the consumer, which reads fixed-size (optionally overlapping) windows.
+    """
+
+    def __init__(self, capacity, window, hop):
+        self.capacity = capacity
+        self.window = window
+        self.hop = hop
+        self.buf = np.zeros(capacity, dtype=np.float32)
+        self.out = np.zeros(window, dtype=np.float32)  # reused for every window handed out
+        self.written = 0   # total samples written (monotonic)
+        self.read_pos = 0  # start of the next window (monotonic)
+        self.overruns = 0
+        self.cond = threading.Condition()
+
+    def write(self, samples):
+        n = len(samples)
+        if n > self.capacity:
+            samples, n = samples[-self.capacity:], self.capacity
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self.buf[start:start + first] = samples[:first]
+        self.buf[:n - first] = samples[first:]
+        with self.cond:
+            self.written += n
+            # Consumer fell more than a ring behind: skip to the oldest audio still in the ring
+            if self.written - self.read_pos > self.capacity:
+                self.overruns += 1
+                self.read_pos = self.written - self.capacity
+            if self.ready():
+                self.cond.notify()
+
+    def ready(self):
+        return self.written - self.read_pos >= self.window
+
+    def read(self, timeout=None, out=None):
+        """
+        Blocks until a full window is buffered (or timeout; 0 = don't wait). Copies it into `out`
+        (default: the ring's own reusable array) and returns it, or None if no window is ready.
+        """
+        with self.cond:
+            if not self.cond.wait_for(self.ready, timeout):
+                return None
+            start = self.read_pos % self.capacity
+            self.read_pos += self.hop
+        out = self.out if out is None else out
+        first = min(self.window, self.capacity - start)
+        out[:first] = self.buf[start:start + first]
+        out[first:] = self.buf[:self.window - first]
+        return out
+
+
+def decode_pcm(data, fmt="f32le", sample_rate=SAMPLE_RATE):
+    """Raw little-endian PCM (mono) -> float32 samples at 32 kHz."""
+    if fmt == "f32le":
+        samples = np.frombuffer(data, dtype="<f4")
+    elif fmt == "s16le":
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.0
+    else:
+        raise ValueError(f"Unsupported PCM format: {fmt}")
+    if not PCM_MIN_RATE <= sample_rate <= PCM_MAX_RATE:
+        raise ValueError(f"Unsupported sample rate: {sample_rate} (expected {PCM_MIN_RATE}-{PCM_MAX_RATE} Hz)")
+    if sample_rate != SAMPLE_RATE and len(samples):
+        # Linear resampling is plenty for speech/whisper tagging
+        n_out = int(round(len(samples) * SAMPLE_RATE / sample_rate))
+        samples = np.interp(np.linspace(0, len(samples) - 1, n_out), np.arange(len(samples)), samples)
+    return samples.astype(np.float32, copy=False)
+
+
 class AudioFeatureAggregator:
-    def __init__(self):
-        self.is_talking_buf = deque(maxlen=5)  # last 5 seconds
-        self.voice_conf_buf = deque(maxlen=5)
+    def __init__(self, hop_sec=AUDIO_HOP_SEC):
+        self.per_sec = max(1, round(1 / hop_sec))  # windows per second of audio
+        self.buf = RingBuffer(5 * self.per_sec, 2, np.float32)  # last 5 seconds of [is_talking, voice_conf]
+        self.audio_features = np.zeros(3, dtype=np.float32)  # latest [t2, t5, conf] for this session
 
     def update(self, features):
-        self.is_talking_buf.append(features["is_talking"])
-        self.voice_conf_buf.append(features["voice_conf"])
+        self.buf.append((features["is_talking"], features["voice_conf"]))
 
     def get_features(self):
-        if len(self.is_talking_buf) < 1:
+        if len(self.buf) < 1:
             return None
-        audio_talking_ratio_2s = np.mean(list(self.is_talking_buf)[-2:])    # Taking the last 2 secs out of the recorded 5 secs and taking thier mean value
-        audio_talking_ratio_5s = np.mean(self.is_talking_buf)
-        audio_conf_mean_2s = np.mean(list(self.voice_conf_buf)[-2:])
+        last_2s = self.buf.values()[-2 * self.per_sec:]    # Taking the last 2 secs out of the recorded 5 secs and taking thier mean value
+        audio_talking_ratio_2s = last_2s[:, 0].mean()
+        audio_talking_ratio_5s = self.buf.window()[:, 0].mean()
+        audio_conf_mean_2s = last_2s[:, 1].mean()
         return [
             float(audio_talking_ratio_2s),
             float(audio_talking_ratio_5s),
@@ -29,19 +125,83 @@ class AudioFeatureAggregator:
         ]
 
 
+class VoiceActivityGate:
+    """Cheap RMS-energy check run on every window before the CNN."""
+
+    def __init__(self, threshold_db=AUDIO_VAD_SENSITIVITY_DB, enabled=AUDIO_VAD):
+        self.threshold_db = threshold_db
+        self.enabled = enabled
+        self.windows = 0
+        self.skipped = 0
+
+    def active(self, audio_batch):
+        """(B, samples) -> bool mask of windows loud enough to be worth tagging."""
+        self.windows += len(audio_batch)
+        metrics.inc("vad_windows", len(audio_batch))
+        if not self.enabled:
+            return np.ones(len(audio_batch), dtype=bool)
+        rms = np.sqrt(np.mean(np.square(audio_batch, dtype=np.float32), axis=1))
+        mask = 20 * np.log10(rms + 1e-10) > self.threshold_db
+        skipped = int(len(mask) - mask.sum())
+        self.skipped += skipped
+        metrics.inc("vad_windows_gated", skipped)
+        return mask
+
+
+SILENT = {"voice_conf": 0.0, "is_talking": 0}
+
+
 class AudioPipeline:
     def __init__(self):
         print("Initializing Audio CNN (PANNs-Cnn14)...")    #DEBUG
         self.device = "cpu"
-        self.model = AudioTagging(checkpoint_path=model_path, device=self.device)
+        self.model = load_audio_tagger(model_path, self.device)  # eager / int8, per AUDIO_RUNTIME
         self.TARGET_MAPPING = {"talking": [0, 137, 138, 139], "whispering": [5]}
         self.threshold = 0.15
+        self.gate = VoiceActivityGate()
+        self.cnn_calls = 0    # Cnn14 forward passes
+        self.cnn_windows = 0  # windows that went through them
 
     def process_chunk(self, audio_chunk):
         audio_tensor = audio_chunk[None, :]     # This line adds a batch dimension, turning a single audio chunk into a batch of one so it can be passed into the model.
-        clipwise_output, _ = self.model.inference(audio_tensor)
-        probs = clipwise_output[0]
-        
+        return self.process_batch(audio_tensor)[0]
+
+    def process_batch(self, audio_batch):
+        """
+        (B, samples) windows, possibly from different sessions -> one Cnn14 forward pass.
+        Silent windows are answered with zero-talking features and left out of the pass.
+        """
+        with metrics.timer("vad"):
+            mask = self.gate.active(audio_batch)
+        features = [SILENT] * len(audio_batch)
+        if not mask.any():
+            return features
+
+        loud = audio_batch if mask.all() else audio_batch[mask]
+        with metrics.timer("cnn14"):
+            clipwise_output, _ = self.model.inference(loud)
+        self.cnn_calls += 1
+        self.cnn_windows += len(loud)
+        metrics.inc("cnn14_calls")
+        metrics.inc("vad_windows_passed", len(loud))
+        for i, probs in zip(np.flatnonzero(mask), clipwise_output):
+            features[i] = self._features(probs)
+        return features
+
+    def stats(self):
+        windows = self.gate.windows
+        return {
+            "vad_enabled": self.gate.enabled,
+            "vad_threshold_db": self.gate.threshold_db,
+            "windows": windows,
+            "skipped_silent": self.gate.skipped,
+            "skip_rate": self.gate.skipped / windows if windows else 0.0,
+            "cnn_calls": self.cnn_calls,
+            "cnn_windows": self.cnn_windows,
+            "cnn_window_rate": self.cnn_windows / windows if windows else 0.0,
+        }
+
+    def _features(self, probs):
         prob_speech = float(np.max(probs[self.TARGET_MAPPING["talking"]]))
         prob_whisper = float(probs[self.TARGET_MAPPING["whispering"][0]])
         voice_activity = max(prob_speech, prob_whisper)
@@ -49,55 +209,89 @@ class AudioPipeline:
         return {"voice_conf": voice_activity, "is_talking": is_talking}
 
 
+class AudioSession:
+    """Per-session audio state: its own sample ring and feature aggregator."""
+
+    def __init__(self, chunk_size, hop_size, hop_sec, ring_windows=AUDIO_RING_WINDOWS):
+        self.ring = SampleRingBuffer(chunk_size * ring_windows, chunk_size, hop_size)
+        self.aggregator = AudioFeatureAggregator(hop_sec)
+
+
 class AudioProcessor:
-    def __init__(self, chunk_sec=1):
-        self.sr = 32000
+    def __init__(self, chunk_sec=AUDIO_WINDOW_SEC, hop_sec=AUDIO_HOP_SEC, mic_session=DEFAULT_SESSION,
+                 source=AUDIO_SOURCE, batch_max=AUDIO_BATCH_MAX):
+        self.sr = SAMPLE_RATE
         self.pipeline = AudioPipeline()
-        self.aggregator = AudioFeatureAggregator()
-        self.q = queue.Queue()
-        self.audio_features = np.zeros(3, dtype=np.float32)
-        self.chunk_size = self.sr * chunk_sec
+        self.chunk_size = int(self.sr * chunk_sec)
+        self.hop_size = int(self.sr * hop_sec)
+        # One ring + aggregator per exam session; the local microphone (if enabled) feeds `mic_session`
+        self.sessions = SessionStore(lambda: AudioSession(self.chunk_size, self.hop_size, hop_sec))
+        self.mic_session = mic_session
+        self.use_mic = source in ("mic", "both")
+        # Ready windows from every session are stacked here and go through Cnn14 together
+        self.batch = np.zeros((max(1, batch_max), self.chunk_size), dtype=np.float32)
+        self.wake = threading.Event()
         self.running = False
 
     def _callback(self, indata, frames, time, status):
-        # Flatten to mono audio
+        # Mono audio straight into the mic session's ring (no per-block allocation)
         if status:
             errors.append({"part": "audio_callback", "error": str(status)})
-        self.q.put(indata.copy().flatten())
+        self.ingest(self.mic_session, indata[:, 0])
+
+    def ingest(self, session_id, samples):
+        """Appends 32 kHz float32 samples to a session (mic callback or the network /ingest endpoint)."""
+        session = self.sessions.get(session_id)
+        session.ring.write(samples)
+        if session.ring.ready():
+            self.wake.set()
+
+    def _collect(self):
+        """Up to batch_max ready windows across all sessions -> (batch view, [aggregators])."""
+        owners = []
+        for _, session in self.sessions.items():
+            while len(owners) < len(self.batch):
+                if session.ring.read(timeout=0, out=self.batch[len(owners)]) is None:
+                    break
+                owners.append(session.aggregator)
+        return self.batch[:len(owners)], owners
 
     def start(self):
         """Main entry point to be called in a background thread"""
         self.running = True
-        print("🎧 Audio Listening started...")  #DEBUG
-        with sd.InputStream(samplerate=self.sr, channels=1, callback=self._callback):
-            buffer = np.zeros(0)
+        print(f"🎧 Audio Listening started (mic={'on' if self.use_mic else 'off'})...")  #DEBUG
+        stream = sd.InputStream(samplerate=self.sr, channels=1, dtype="float32",
+                                callback=self._callback) if self.use_mic else nullcontext()
+        with stream:
             while self.running:
-                try:
-                    # append all available audio to buffer
-                    while not self.q.empty():
-                        buffer = np.concatenate([buffer, self.q.get()])
-
-                    # process 1-second chunks
-                    while len(buffer) >= self.chunk_size:
-                        chunk = buffer[:self.chunk_size]
-                        buffer = buffer[self.chunk_size:]
-
-                      
-
-                        features = self.pipeline.process_chunk(chunk)
-                        self.aggregator.update(features)
-                        final_features = self.aggregator.get_features()
-
-                        if final_features is not None:
-                            # update the global variable that downstream model can read
-                            self.audio_features = np.array(final_features, dtype=np.float32)
-                            # debug print for each 1-second chunk
-                            print("Chunk processed, audio_features =", self.audio_features)
-
-                except Exception as e:
-                           errors.append({"part": "processing_chunk", "error": str(e)})
-                
-                # Small sleep to prevent CPU spiking while waiting for audio data (pause the main thread for 100 milliseconds while audio keeps recording.)
-                sd.sleep(100)
+                # Wakes as soon as any session has a full window buffered
+                if not self.wake.wait(timeout=0.5):
+                    continue
+                self.wake.clear()
+                while True:
+                    windows, owners = self._collect()
+                    if not owners:
+                        break
+                    try:
+                        for aggregator, features in zip(owners, self.pipeline.process_batch(windows)):
+                            aggregator.update(features)
+                            final_features = aggregator.get_features()
+
+                            if final_features is not None:
+                                # update the session's features that downstream model can read
+                                aggregator.audio_features = np.array(final_features, dtype=np.float32)
+
+                    except Exception as e:
+                               errors.append({"part": "processing_chunk", "error": str(e)})
+
     def stop(self):
-        self.running = False
\ No newline at end of file
+        self.running = False
+
+    def get_features(self, session_id=DEFAULT_SESSION):
+        """Latest [t2, t5, conf] for a session. Sessions without their own audio read the local microphone."""
+        session = self.sessions.peek(session_id)
+        if session is None and self.use_mic:
+            session = self.sessions.peek(self.mic_session)
+        if session is None:
+            return [0.0, 0.0, 0.0]
+        return session.aggregator.audio_features.tolist()
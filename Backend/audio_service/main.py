@@ -1,14 +1,24 @@
 import numpy as np
 import threading
-from fastapi import FastAPI
-from audio_module import AudioProcessor
+from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
+from audio_module import AudioProcessor, decode_pcm
+from common.session_store import DEFAULT_SESSION
+from common.metrics import metrics, instrument
 
 app = FastAPI()
+instrument(app)  # /metrics
 
 # Initialize the AudioProcessor (PANNs + Aggregator)
 # Note: AudioProcessor in audio_module handles its own threading for the stream
 audio_engine = AudioProcessor()
 
+# Read on every /metrics scrape
+metrics.gauge("sessions", lambda: len(audio_engine.sessions))
+metrics.gauge("ring_overruns", lambda: sum(s.ring.overruns for _, s in audio_engine.sessions.items()))
+# VAD and Cnn14 counts are counters (the pipeline bumps them), exported from zero so rate() works from the start
+for counter in ("vad_windows", "vad_windows_gated", "vad_windows_passed", "cnn14_calls"):
+    metrics.inc(counter, 0)
+
 @app.on_event("startup")
 def start_audio_engine():
     """Starts the background audio capture thread on service boot."""
@@ -16,15 +26,54 @@ def start_audio_engine():
     thread.start()
 
 @app.get("/get_features")
-async def get_audio_features():
+async def get_audio_features(session_id: str = DEFAULT_SESSION):
     """
     Returns [talking_2s, talking_5s, conf] to the Gateway.
     Matches the contract expected by fusion_module.
     """
     # audio_features is updated in the background thread every 1 second
-    features = audio_engine.audio_features.tolist()
+    features = audio_engine.get_features(session_id)
     return features
 
+@app.get("/health")
+async def health():
+    """Cnn14 is loaded before the server starts listening, so answering means ready."""
+    return {"status": "ready", "mic": audio_engine.use_mic, "sessions": len(audio_engine.sessions)}
+
+@app.get("/vad_stats")
+async def vad_stats():
+    """How many windows the energy pre-gate kept away from Cnn14 (AUDIO_VAD_SENSITIVITY tunes it)."""
+    return audio_engine.pipeline.stats()
+
+@app.post("/ingest")
+async def ingest_audio(request: Request, session_id: str = DEFAULT_SESSION,
+                       format: str = "f32le", sample_rate: int = 32000):
+    """
+    Network audio for one session: the body is a chunk of raw mono PCM (f32le or s16le).
+    Chunks from all sessions are windowed per session and batched into shared Cnn14 passes.
+    """
+    try:
+        body = await request.body()
+        with metrics.timer("pcm_decode"):
+            samples = decode_pcm(body, format, sample_rate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    audio_engine.ingest(session_id, samples)
+    return {"status": "ok", "samples": len(samples)}
+
+
+@app.websocket("/ws/{session_id}")
+async def ingest_stream(websocket: WebSocket, session_id: str, format: str = "f32le", sample_rate: int = 32000):
+    """Same as /ingest over one persistent socket: every binary message is a PCM chunk."""
+    await websocket.accept()
+    try:
+        while True:
+            audio_engine.ingest(session_id, decode_pcm(await websocket.receive_bytes(), format, sample_rate))
+    except WebSocketDisconnect:
+        pass
+    except ValueError as e:
+        await websocket.close(code=1003, reason=str(e))
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8003)
\ No newline at end of file
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from audio_module import decode_pcm, SAMPLE_RATE, PCM_MIN_RATE, PCM_MAX_RATE
+
+
+@pytest.mark.parametrize("sample_rate", [0, -16000, PCM_MIN_RATE - 1, PCM_MAX_RATE + 1])
+def test_decode_pcm_rejects_bad_sample_rate(sample_rate):
+    chunk = np.zeros(320, dtype="<f4").tobytes()
+    with pytest.raises(ValueError):
+        decode_pcm(chunk, "f32le", sample_rate)
+
+
+def test_decode_pcm_resamples_to_model_rate():
+    chunk = np.zeros(16000, dtype="<i2").tobytes()  # 1 s at 16 kHz
+    samples = decode_pcm(chunk, "s16le", 16000)
+    assert samples.dtype == np.float32
+    assert len(samples) == SAMPLE_RATE
@@ -0,0 +1,127 @@
+"""Helpers shared by the benchmark scripts: latency distributions, percentiles, frames and result files."""
+import glob
+import json
+import os
+import random
+import cv2
+import numpy as np
+
+
+def parse_latency(spec):
+    """
+    "constant:20" | "uniform:10:40" | "normal:25:5" | "lognormal:20:0.5" (median ms, sigma)
+    -> function returning one latency sample in seconds (never negative)
+    """
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "constant":
+        sample = lambda: args[0]
+    elif kind == "uniform":
+        sample = lambda: random.uniform(args[0], args[1])
+    elif kind == "normal":
+        sample = lambda: random.gauss(args[0], args[1])
+    elif kind == "lognormal":
+        sample = lambda: args[0] * float(np.exp(random.gauss(0.0, args[1])))
+    else:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+    return lambda: max(0.0, sample()) / 1000
+
+
+def summarize(samples_ms):
+    """count / mean / p50 / p95 / p99 / max of a list of millisecond samples"""
+    if not samples_ms:
+        return {"count": 0}
+    values = np.asarray(samples_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean": float(values.mean()),
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "max": float(values.max()),
+    }
+
+
+def print_table(rows):
+    """rows: {name: summarize(...)} -> aligned text table"""
+    width = max([14] + [len(name) + 2 for name in rows])
+    print(f"{'stage':<{width}}{'count':>8}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, s in rows.items():
+        if not s.get("count"):
+            print(f"{name:<{width}}{0:>8}")
+            continue
+        print(f"{name:<{width}}{s['count']:>8}{s['mean']:>10.1f}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}")
+
+
+def synthetic_frames(count=30, width=640, height=480, seed=0):
+    """JPEG frames of a slowly moving 'head' over a noisy background (so change detection sees motion)."""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(40, 90, (height, width, 3), dtype=np.uint8)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        cx = width // 2 + int(40 * np.sin(2 * np.pi * i / count))
+        cv2.ellipse(frame, (cx, height // 2), (70, 95), 0, 0, 360, (150, 170, 200), -1)
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        frames.append(buf.tobytes())
+    return frames
+
+
+def load_frames(folder):
+    """Recorded JPEG frames from a folder (sorted by name)."""
+    paths = sorted(glob.glob(os.path.join(folder, "*.jpg")) + glob.glob(os.path.join(folder, "*.jpeg")))
+    frames = []
+    for path in paths:
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    if not frames:
+        raise SystemExit(f"No .jpg frames in {folder}")
+    return frames
+
+
+def snapshot_tree(root):
+    """{relative path: (size, mtime_ns)} of every file and directory under root (bytecode caches excluded)."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d != "__pycache__"]
+        for name in dirnames:
+            # Directories only count as created/deleted (their mtime moves with their contents)
+            files[os.path.relpath(os.path.join(dirpath, name), root) + os.sep] = (0, 0)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files[os.path.relpath(path, root)] = (st.st_size, st.st_mtime_ns)
+    return files
+
+
+def tree_changes(before, after):
+    """Files created, modified or deleted between two snapshot_tree() calls."""
+    created = sorted(set(after) - set(before))
+    deleted = sorted(set(before) - set(after))
+    modified = sorted(p for p in set(before) & set(after) if before[p] != after[p])
+    return {"created": created, "modified": modified, "deleted": deleted}
+
+
+def save_results(path, results):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def compare(results, baseline_path, metric="p50", max_regression=0.2):
+    """Prints regressions against a saved run. Returns False when any stage got slower than allowed."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    ok = True
+    for name, s in results.items():
+        old = baseline.get(name, {}).get(metric)
+        if not old or not s.get(metric):
+            continue
+        change = s[metric] / old - 1
+        regressed = change > max_regression
+        ok = ok and not regressed
+        print(f"{'❌' if regressed else '✅'} {name}: {metric} {old:.1f} -> {s[metric]:.1f} ms ({change:+.0%})")
+    return ok
@@ -0,0 +1,115 @@
+"""
+Load generator for the gateway: N concurrent exam sessions, each posting frames to /analyze at a
+fixed rate. Open loop: every frame is sent at its scheduled time whether or not the previous
+one was answered, and latency is measured from that scheduled time, so a slow backend shows up
+as latency rather than as a lower offered rate. Sends that left more than LATE_MS after their
+slot (the load generator itself falling behind) are counted as late_sends.
+
+    python load_test.py --sessions 50 --fps 2 --duration 60
+    python load_test.py --frames recorded_frames/ --sessions 200 --fps 1 --save run.json
+
+Reports achieved throughput plus p50/p95/p99 end to end and per stage: the gateway's own timings
+(vision, identity, audio, fusion, total) and each backend's internal stages (backend.decode,
+backend.yolo_forward, ...). Combine with stub_services.py to benchmark the gateway alone or any
+mix of real and stubbed workers.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import defaultdict
+import httpx
+from bench_utils import summarize, print_table, synthetic_frames, load_frames, save_results, compare
+
+LATE_MS = 10.0  # a send starting this long after its slot counts as late
+
+
+async def send_frame(client, url, frame, session_id, scheduled, samples, counters):
+    # Latency counts from the scheduled send time, so a backlog anywhere (client, gateway,
+    # backends) shows up in the percentiles instead of quietly lowering the offered rate
+    late_ms = (time.perf_counter() - scheduled) * 1000
+    if late_ms > LATE_MS:
+        counters["late_sends"] += 1
+    try:
+        res = await client.post(url, files={"file": ("frame.jpg", frame, "image/jpeg")},
+                                data={"session_id": session_id, "timings": "true"})
+        elapsed = (time.perf_counter() - scheduled) * 1000
+        if res.status_code != 200:
+            counters[f"http_{res.status_code}"] += 1
+            return
+        samples["end_to_end"].append(elapsed)
+        body = res.json()
+        for stage, ms in body.get("timings", {}).items():
+            samples[stage].append(ms)
+        # Each backend's internal stages (decode, yolo_forward, facenet, ...)
+        for backend, stages in (body.get("stages") or {}).items():
+            for stage, ms in stages.items():
+                samples[f"{backend}.{stage}"].append(ms)
+        for name in body.get("stale", []):
+            counters[f"stale_{name}"] += 1
+        counters["ok"] += 1
+    except httpx.HTTPError:
+        counters["errors"] += 1
+
+
+async def run_session(client, url, frames, fps, deadline, samples, counters, offset):
+    session_id = str(uuid.uuid4())
+    interval = 1.0 / fps
+    # Spread session start times over one interval so requests don't arrive in lockstep
+    next_at = time.perf_counter() + offset * interval
+    in_flight = set()
+    i = 0
+    while next_at < deadline:
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        # Each frame is its own task: the next one goes out on schedule even if this one is still waiting
+        task = asyncio.create_task(
+            send_frame(client, url, frames[i % len(frames)], session_id, next_at, samples, counters))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        counters["sent"] += 1
+        next_at += interval
+        i += 1
+    await asyncio.gather(*in_flight)
+
+
+async def main(args):
+    frames = load_frames(args.frames) if args.frames else synthetic_frames()
+    samples, counters = defaultdict(list), defaultdict(int)
+    # No connection cap: a session with several frames in flight opens extra connections instead of
+    # queueing them inside the client (that wait would be hidden from the gateway's timings)
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=args.sessions)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            run_session(client, args.url, frames, args.fps, deadline, samples, counters, i / args.sessions)
+            for i in range(args.sessions)))
+        elapsed = time.perf_counter() - start
+
+    offered = args.sessions * args.fps
+    print(f"\n📈 {args.sessions} sessions x {args.fps} fps = {offered:.1f} frames/s offered, "
+          f"{counters['sent'] / elapsed:.1f} frames/s sent, {counters['ok'] / elapsed:.1f} frames/s answered "
+          f"over {elapsed:.1f}s")
+    print("   " + ", ".join(f"{k}={v}" for k, v in sorted(counters.items())))
+    results = {name: summarize(values) for name, values in samples.items()}
+    results["end_to_end"] = results.pop("end_to_end", {"count": 0})
+    print_table(results)
+
+    if args.save:
+        save_results(args.save, results)
+    if args.baseline and not compare(results, args.baseline, max_regression=args.max_regression):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Drive gateway /analyze with concurrent sessions.")
+    parser.add_argument("--url", default="http://localhost:8000/analyze")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=1.0, help="frames per second per session")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--frames", help="folder of recorded .jpg frames (default: synthetic)")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--save", help="write the per-stage summary to this JSON file")
+    parser.add_argument("--baseline", help="fail if p50 regressed against this saved summary")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,169 @@
+"""
+Microbenchmarks: each model stage on its own, in-process, without HTTP or the gateway.
+
+    python microbench.py vision                # YOLO single frame and batch of --batch
+    python microbench.py gaze --frames faces/  # FaceMesh + pose (needs frames with a face to be meaningful)
+    python microbench.py decode --frames hd/   # full decode vs reduced-scale preprocessing
+    python microbench.py identity              # YOLO detect, FaceNet + classifier
+    python microbench.py audio                 # Cnn14 on one 1 s window and on a batch
+    python microbench.py vision --save vision.json
+    python microbench.py vision --baseline vision.json   # exit 1 if any p50 regressed > 20%
+    python microbench.py identity_api --iters 500 --check-writes   # exit 1 if /process touched the disk
+
+Run it inside the service's container (or with its requirements installed): the target service
+directory (and Backend/, for common/) is put on sys.path and made the working directory, so
+relative weight paths resolve.
+The *_api targets drive the service's own /process endpoint in-process (FastAPI TestClient).
+--check-writes fails the run when any file under the service directory was created, modified or
+deleted while the stages ran (model loading and one-time exports happen before the snapshot).
+"""
+import argparse
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from bench_utils import (summarize, print_table, synthetic_frames, load_frames, save_results, compare,
+                         snapshot_tree, tree_changes)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICE_DIRS = {"vision": "vision_service", "gaze": "vision_service", "decode": "vision_service",
+                "vision_api": "vision_service",
+                "identity": "identity_service", "identity_api": "identity_service", "audio": "audio_service"}
+
+
+def use_service(target):
+    service_dir = os.path.join(BACKEND_DIR, SERVICE_DIRS[target])
+    sys.path[:0] = [service_dir, BACKEND_DIR]  # the service's modules, then Backend/common
+    os.chdir(service_dir)
+
+
+def vision_stages(frames, batch):
+    from vision_module import VisionProcessor
+    vision = VisionProcessor()
+    return {
+        "yolo_x1": lambda i: vision.detect_batch([frames[i % len(frames)]]),
+        f"yolo_x{batch}": lambda i: vision.detect_batch([frames[(i + k) % len(frames)] for k in range(batch)]),
+    }
+
+
+def gaze_stages(frames, batch):
+    from gaze_module import GazeProcessor
+    gaze = GazeProcessor()
+    rgb = [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in frames]
+    h, w = frames[0].shape[:2]
+    box = [w // 3, h // 5, 2 * w // 3, 4 * h // 5]  # a centered face-sized box
+    return {
+        "facemesh_full": lambda i: gaze.process_frame(frames[i % len(frames)]),
+        "facemesh_roi": lambda i: gaze.landmarks(rgb[i % len(rgb)], box),
+    }
+
+
+def decode_stages(frames, batch):
+    """Full-size decode vs the shared preprocessing stage (reduced-scale decode + one RGB buffer)."""
+    from preprocess import prepare
+    encoded = [cv2.imencode(".jpg", f)[1].tobytes() for f in frames]
+    return {
+        "imdecode_full": lambda i: cv2.imdecode(np.frombuffer(encoded[i % len(encoded)], np.uint8), cv2.IMREAD_COLOR),
+        "prepare": lambda i: prepare(encoded[i % len(encoded)]),
+        "prepare_rgb": lambda i: prepare(encoded[i % len(encoded)]).rgb,
+    }
+
+
+def identity_stages(frames, batch):
+    from identity_module import IdentityProcessor
+    identity = IdentityProcessor()
+    faces = [cv2.resize(cv2.cvtColor(f, cv2.COLOR_BGR2RGB), (160, 160)) for f in frames]
+    return {
+        "yolo_x1": lambda i: identity.detect_batch([frames[i % len(frames)]]),
+        "facenet_x1": lambda i: identity.identify_batch([faces[i % len(faces)]]),
+        f"facenet_x{batch}": lambda i: identity.identify_batch([faces[(i + k) % len(faces)] for k in range(batch)]),
+    }
+
+
+def audio_stages(frames, batch):
+    from audio_module import AudioPipeline
+    pipeline = AudioPipeline()
+    rng = np.random.default_rng(0)
+    windows = rng.normal(0, 0.1, (batch, 32000)).astype(np.float32)  # loud enough to pass the VAD gate
+    return {
+        "cnn14_x1": lambda i: pipeline.process_chunk(windows[i % batch]),
+        f"cnn14_x{batch}": lambda i: pipeline.process_batch(windows),
+        "vad_gate": lambda i: pipeline.gate.active(windows),
+    }
+
+
+def api_stages(frames, batch):
+    """Full /process requests (decode, frame gate, models, history) against the service's app."""
+    from fastapi.testclient import TestClient
+    from main import app
+    client = TestClient(app)
+    client.__enter__()  # startup hooks, and one event loop for all requests (the micro-batcher lives on it)
+    encoded = [cv2.imencode(".jpg", f)[1].tobytes() for f in frames]
+
+    def process(i):
+        res = client.post("/process", files={"file": ("frame.jpg", encoded[i % len(encoded)], "image/jpeg")},
+                          data={"session_id": f"bench-{i % batch}"})
+        res.raise_for_status()
+
+    return {"process": process}
+
+
+STAGES = {"vision": vision_stages, "gaze": gaze_stages, "decode": decode_stages,
+          "identity": identity_stages, "audio": audio_stages,
+          "vision_api": api_stages, "identity_api": api_stages}
+
+
+def bench(stages, iters, warmup):
+    results = {}
+    for name, fn in stages.items():
+        for i in range(warmup):
+            fn(i)
+        samples = []
+        for i in range(iters):
+            start = time.perf_counter()
+            fn(i)
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = summarize(samples)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark model stages in isolation.")
+    parser.add_argument("target", choices=sorted(STAGES))
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--frames", help="folder of .jpg frames (default: synthetic)")
+    parser.add_argument("--save", help="write the summary to this JSON file")
+    parser.add_argument("--baseline", help="fail if p50 regressed against this saved summary")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--check-writes", action="store_true",
+                        help="fail if the stages created/modified/deleted files in the service directory")
+    args = parser.parse_args()
+
+    encoded = load_frames(args.frames) if args.frames else synthetic_frames()
+    frames = [cv2.imdecode(np.frombuffer(b, np.uint8), cv2.IMREAD_COLOR) for b in encoded]
+    # Output paths are relative to where we were started, not to the service directory
+    save, baseline = (os.path.abspath(p) if p else None for p in (args.save, args.baseline))
+    use_service(args.target)
+
+    stages = STAGES[args.target](frames, args.batch)
+    before = snapshot_tree(os.getcwd()) if args.check_writes else None
+    results = bench(stages, args.iters, args.warmup)
+    print(f"\n🔬 {args.target}: {args.iters} iterations per stage")
+    print_table(results)
+
+    if before is not None:
+        changes = tree_changes(before, snapshot_tree(os.getcwd()))
+        for kind, paths in changes.items():
+            for path in paths:
+                print(f"❌ {kind}: {path}")
+        if any(changes.values()):
+            raise SystemExit(1)
+        print(f"✅ No files written under {os.getcwd()}")
+
+    if save:
+        save_results(save, results)
+    if baseline and not compare(results, baseline, max_regression=args.max_regression):
+        raise SystemExit(1)
@@ -0,0 +1,103 @@
+"""
+Stand-ins for the model services: same endpoints and response shapes, no models, a configurable
+latency distribution per service. Run any subset and point the gateway at them, so a benchmark can
+mix real and stubbed workers.
+
+    python stub_services.py vision=lognormal:35:0.4 identity=normal:30:8 audio=constant:2
+
+then start the gateway with VISION_URL=http://localhost:8001/process_raw,
+IDENTITY_URL=http://localhost:8002/process_raw, AUDIO_URL=http://localhost:8003/get_features
+(any service left out keeps its real URL).
+"""
+import argparse
+import asyncio
+import threading
+import uvicorn
+from fastapi import FastAPI, Request
+from bench_utils import parse_latency
+
+PORTS = {"vision": 8001, "identity": 8002, "audio": 8003}
+
+
+def vision_app(latency):
+    app = FastAPI()
+
+    async def respond(return_face):
+        await asyncio.sleep(latency())
+        features = [0.0, 0.0, 0.0, 0.0, 0.0]
+        if return_face:
+            return {"features": features, "face_box": [220, 120, 420, 380], "num_boxes": 1}
+        return features
+
+    @app.post("/process_raw")
+    async def process_raw(request: Request, session_id: str = "default", return_face: bool = False):
+        await request.body()
+        return await respond(return_face)
+
+    @app.post("/process")
+    async def process(request: Request):
+        form = await request.form()
+        return await respond(str(form.get("return_face", "false")).lower() == "true")
+
+    return app
+
+
+def identity_app(latency):
+    app = FastAPI()
+
+    @app.post("/process_raw")
+    async def process_raw(request: Request):
+        await request.body()
+        await asyncio.sleep(latency())
+        return [1.0, 0.0, 0.0]
+
+    @app.post("/process")
+    async def process(request: Request):
+        await request.form()
+        await asyncio.sleep(latency())
+        return [1.0, 0.0, 0.0]
+
+    return app
+
+
+def audio_app(latency):
+    app = FastAPI()
+
+    @app.get("/get_features")
+    async def get_features(session_id: str = "default"):
+        await asyncio.sleep(latency())
+        return [0.0, 0.0, 0.0]
+
+    @app.post("/ingest")
+    async def ingest(request: Request):
+        await request.body()
+        return {"status": "ok"}
+
+    return app
+
+
+APPS = {"vision": vision_app, "identity": identity_app, "audio": audio_app}
+
+
+def serve(name, spec, host):
+    print(f"🧪 {name} stub on :{PORTS[name]} (latency {spec})")
+    uvicorn.run(APPS[name](parse_latency(spec)), host=host, port=PORTS[name], log_level="warning")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run latency-configurable stubs of the model services.")
+    parser.add_argument("stubs", nargs="+", help="service=distribution, e.g. vision=lognormal:35:0.4")
+    parser.add_argument("--host", default="0.0.0.0")
+    args = parser.parse_args()
+
+    threads = []
+    for stub in args.stubs:
+        name, _, spec = stub.partition("=")
+        if name not in APPS:
+            raise SystemExit(f"Unknown service '{name}', expected one of {', '.join(APPS)}")
+        parse_latency(spec or "constant:0")  # fail fast on a bad spec
+        threads.append(threading.Thread(target=serve, args=(name, spec or "constant:0", args.host), daemon=True))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
@@ -0,0 +1,8 @@
+"""
+Modules shared by the backend services: per-session state, micro-batching, worker pools, the
+frame gate, metrics, model runtimes and box geometry. One copy here; docker-compose hands the folder to every
+service build as the `common` context and the Dockerfiles copy it to /app/common.
+
+Outside Docker, run a service with Backend/ on the path, e.g. from vision_service/:
+    PYTHONPATH=.. uvicorn main:app --port 8001
+"""
@@ -0,0 +1,90 @@
+import asyncio
+import os
+from collections import Counter
+from .metrics import current_breakdown, batch_breakdown
+from .workers import QueueFull, MODEL_QUEUE_LIMIT
+
+# Micro-batching knobs (can also come from environment variables)
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))            # frames per forward pass
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))    # how long the first frame waits for company
+
+
+class MicroBatcher:
+    """
+    Collects items from concurrent requests until `max_batch` items or `max_wait_ms` have passed,
+    runs them through `run_batch(model, items) -> results` in one call on a ModelPool worker, and
+    hands each request its own result back. One batch can be in flight per pool worker.
+    """
+
+    def __init__(self, run_batch, pool, max_batch=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 max_pending=MODEL_QUEUE_LIMIT):
+        self.run_batch = run_batch
+        self.pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_pending = max_pending
+        self._queue = None   # created on first use, inside the server's event loop
+        self._workers = []
+        # Achieved batch sizes
+        self.batches = 0
+        self.items = 0
+        self.sizes = Counter()
+
+    async def submit(self, item):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._workers = [asyncio.create_task(self._run()) for _ in range(self.pool.workers)]
+        if self._queue.qsize() >= self.max_pending:
+            raise QueueFull(f"{self.pool.name} batch queue is full")
+        future = asyncio.get_running_loop().create_future()
+        # The batch runs on this batcher's own task, so the request's breakdown travels with the item
+        await self._queue.put((item, future, current_breakdown()))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            # Whatever is already waiting joins for free, otherwise wait out the remaining budget
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            items = [item for item, _, _ in batch]
+            self.batches += 1
+            self.items += len(items)
+            self.sizes[len(items)] += 1
+            try:
+                with batch_breakdown([breakdown for _, _, breakdown in batch]):
+                    results = await self.pool.submit(self.run_batch, items)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():  # the request may have been cancelled meanwhile
+                    future.set_result(result)
+
+    def stats(self):
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "batch_sizes": {str(k): v for k, v in sorted(self.sizes.items())},
+        }
@@ -0,0 +1,13 @@
+"""Box geometry shared by the services. Boxes are [x1, y1, x2, y2] in pixels."""
+
+
+def box_area(box):
+    return max(0, box[2] - box[0]) * max(0, box[3] - box[1])
+
+
+def box_iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, x2 - x1) * max(0, y2 - y1)
+    union = box_area(a) + box_area(b) - inter
+    return inter / union if union > 0 else 0.0
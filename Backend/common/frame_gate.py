@@ -0,0 +1,83 @@
+"""
+Per-session change detector in front of the heavy models (Backend/common, shared by the services that need it).
+
+Each frame is shrunk to a small grayscale thumbnail and compared with the thumbnail of the last
+frame that went through the models. The thumbnails are compared block by block (each block is
+1/64 of the frame): only if the mean absolute difference of EVERY block is below the threshold
+does the frame count as unchanged, and the caller reuses that frame's results (still appending
+them to the session's temporal history). A whole-frame average would let a small change, like a
+phone entering one corner, drown in the unchanged rest of the frame. Every FRAME_GATE_REFRESH-th frame is recomputed regardless, so a
+slow change can never hide behind the gate for long.
+"""
+import os
+import cv2
+import numpy as np
+from .session_store import SessionStore
+
+FRAME_GATE = os.getenv("FRAME_GATE", "1") == "1"
+FRAME_GATE_THRESHOLD = float(os.getenv("FRAME_GATE_THRESHOLD", "3.0"))  # max over blocks of mean |diff| (0-255)
+FRAME_GATE_REFRESH = int(os.getenv("FRAME_GATE_REFRESH", "10"))       # force a full pass at least this often
+THUMB_SIZE = 32
+BLOCK = 4  # thumbnail pixels per block side -> 8x8 blocks (80x60 px each in a 640x480 frame)
+
+
+class GateState:
+    def __init__(self):
+        self.thumb = None    # thumbnail of the last fully processed frame
+        self.result = None   # what the models said about it
+        self.reused = 0      # frames answered from it since
+
+
+class FrameGate:
+    def __init__(self, threshold=FRAME_GATE_THRESHOLD, refresh=FRAME_GATE_REFRESH, enabled=FRAME_GATE):
+        self.threshold = threshold
+        self.refresh = refresh
+        self.enabled = enabled
+        self.sessions = SessionStore(GateState)
+        self.frames = 0
+        self.reused = 0
+
+    @staticmethod
+    def thumbnail(frame):
+        small = cv2.resize(frame, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+
+    @staticmethod
+    def change(a, b):
+        """Largest per-block mean |a - b| between two thumbnails."""
+        n = THUMB_SIZE // BLOCK
+        return float(np.abs(a - b).reshape(n, BLOCK, n, BLOCK).mean(axis=(1, 3)).max())
+
+    def check(self, session_id, frame, force=False):
+        """
+        Returns (cached_result, thumb). cached_result is not None when the frame is effectively
+        unchanged; otherwise run the models and hand the result back with store(session_id, thumb, result).
+        force=True always asks for a full pass (the caller's own tracking is due for a refresh).
+        """
+        self.frames += 1
+        if not self.enabled:
+            return None, None
+        thumb = self.thumbnail(frame)
+        state = self.sessions.get(session_id)
+        if (not force and state.result is not None and state.reused < self.refresh - 1
+                and self.change(thumb, state.thumb) < self.threshold):
+            state.reused += 1
+            self.reused += 1
+            return state.result, thumb
+        return None, thumb
+
+    def store(self, session_id, thumb, result):
+        if thumb is None:
+            return
+        state = self.sessions.get(session_id)
+        state.thumb, state.result, state.reused = thumb, result, 0
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "frames": self.frames,
+            "reused": self.reused,
+            "reuse_rate": self.reused / self.frames if self.frames else 0.0,
+        }
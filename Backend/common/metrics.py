@@ -0,0 +1,161 @@
+"""
+Low-overhead timing layer shared by all services (Backend/common).
+
+    from common.metrics import metrics, instrument
+    instrument(app)                          # /metrics (Prometheus text format) + in-flight/request timing
+    with metrics.timer("yolo"): ...          # per-stage latency histogram
+    metrics.gauge("batch_pending", lambda: batcher.stats()["pending"])
+
+Per-request breakdown: a request carrying the `x-stage-timings: 1` header gets every stage timed
+during it back as JSON in the `x-stage-timings` response header: on the request's own task, on
+ModelPool workers (they run in a copy of the request's context) and inside micro-batches (each
+item of a batch is charged the batch's stage times, see batch_breakdown).
+The gateway uses this to attach sampled breakdowns to /analyze.
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi import Request
+from fastapi.responses import PlainTextResponse
+
+# Histogram bucket upper bounds in ms (+Inf is implicit)
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+STAGE_HEADER = "x-stage-timings"
+
+# Stage timings of the request being served, when it asked for them
+_breakdown: ContextVar = ContextVar("stage_breakdown", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, ms):
+        i = bisect_left(self.buckets, ms)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += ms
+            self.count += 1
+
+
+class Metrics:
+    def __init__(self, prefix="invigilai"):
+        self.prefix = prefix
+        self.histograms = {}  # stage -> Histogram
+        self.gauges = {}      # name -> callable returning a number
+        self.counters = {}    # name -> int
+        self.lock = threading.Lock()
+
+    def observe(self, stage, ms):
+        hist = self.histograms.get(stage)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(stage, Histogram())
+        hist.observe(ms)
+        breakdown = _breakdown.get()
+        if breakdown is not None:
+            breakdown[stage] = breakdown.get(stage, 0.0) + ms
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1000)
+
+    def gauge(self, name, fn):
+        """fn() is only called when /metrics is scraped"""
+        self.gauges[name] = fn
+
+    def inc(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def render(self):
+        """Prometheus text exposition format"""
+        p = self.prefix
+        lines = [f"# TYPE {p}_stage_duration_ms histogram"]
+        for stage, h in sorted(self.histograms.items()):
+            with h.lock:
+                counts, total, count = list(h.counts), h.sum, h.count
+            cumulative = 0
+            for le, c in zip(list(h.buckets) + ["+Inf"], counts):
+                cumulative += c
+                lines.append(f'{p}_stage_duration_ms_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{p}_stage_duration_ms_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{p}_stage_duration_ms_count{{stage="{stage}"}} {count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {p}_{name}_total counter")
+            lines.append(f"{p}_{name}_total {value}")
+        for name, fn in sorted(self.gauges.items()):
+            try:
+                value = float(fn())
+            except Exception:
+                continue
+            lines.append(f"# TYPE {p}_{name} gauge")
+            lines.append(f"{p}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def current_breakdown():
+    """Stage breakdown dict of the request being served, or None when it didn't ask for one."""
+    return _breakdown.get()
+
+
+@contextmanager
+def batch_breakdown(targets):
+    """
+    Collects the stages timed inside the block (in this task and the pool work it awaits) and adds
+    them to every breakdown in `targets`: a batch's forward pass counts fully against each request in it.
+    """
+    targets = [t for t in targets if t is not None]
+    collected = {} if targets else None
+    token = _breakdown.set(collected)
+    try:
+        yield
+    finally:
+        _breakdown.reset(token)
+        for target in targets:
+            for stage, ms in collected.items():
+                target[stage] = target.get(stage, 0.0) + ms
+
+
+def instrument(app, registry=metrics):
+    """Adds /metrics, request in-flight/latency tracking and the per-request stage breakdown."""
+    in_flight = [0]
+    registry.gauge("requests_in_flight", lambda: in_flight[0])
+
+    @app.middleware("http")
+    async def track_requests(request: Request, call_next):
+        if request.url.path == "/metrics":
+            return await call_next(request)
+        breakdown = {} if request.headers.get(STAGE_HEADER) == "1" else None
+        token = _breakdown.set(breakdown)
+        in_flight[0] += 1
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            in_flight[0] -= 1
+            _breakdown.reset(token)
+        # Label by endpoint, not raw path (ids in paths would explode the label set)
+        endpoint = request.scope.get("endpoint")
+        registry.observe(f"http_{getattr(endpoint, '__name__', 'unmatched')}", (time.perf_counter() - start) * 1000)
+        if breakdown:
+            response.headers[STAGE_HEADER] = json.dumps({k: round(v, 3) for k, v in breakdown.items()})
+        return response
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def scrape():
+        return registry.render()
@@ -0,0 +1,222 @@
+"""
+Model runtimes shared by the model services (Backend/common). Every model library is imported
+inside its loader, so a service only needs the packages of the models it actually loads.
+
+Every model runs as plain eager PyTorch by default. An environment variable per model selects
+a faster exported / quantized variant instead:
+
+    YOLO_RUNTIME     eager | torchscript | onnx      (onnx needs onnx + onnxruntime installed)
+    FACENET_RUNTIME  eager | torchscript | int8
+    AUDIO_RUNTIME    eager | int8
+
+A variant that cannot be built or loaded falls back to eager. With MODEL_PARITY_CHECK=1 the
+variant is also compared against eager on recorded samples (PARITY_SAMPLES) at load time and is
+only used when the outputs agree; with too few samples it is not used at all. The same check
+runs offline:
+
+    python -m common.model_runtime yolo --runtime onnx --weights /app/weights/best.pt --samples parity_samples/
+"""
+import copy
+import glob
+import os
+import numpy as np
+from .boxes import box_iou
+
+YOLO_RUNTIME = os.getenv("YOLO_RUNTIME", "eager")
+FACENET_RUNTIME = os.getenv("FACENET_RUNTIME", "eager")
+AUDIO_RUNTIME = os.getenv("AUDIO_RUNTIME", "eager")
+
+PARITY_CHECK = os.getenv("MODEL_PARITY_CHECK", "0") == "1"
+PARITY_SAMPLES = os.getenv("PARITY_SAMPLES", "parity_samples")  # images (.jpg/.png) and/or audio windows (.npy)
+PARITY_MAX_SAMPLES = int(os.getenv("PARITY_MAX_SAMPLES", "16"))
+PARITY_MIN_SAMPLES = int(os.getenv("PARITY_MIN_SAMPLES", "4"))  # fewer real samples -> the variant is not adopted
+
+# Minimum agreement (0..1) a variant needs with eager:
+#   yolo: mean IoU of class-matched boxes, facenet: worst cosine similarity, cnn14: 1 - max |prob diff|
+PARITY_MIN = {"yolo": 0.90, "facenet": 0.99, "cnn14": 0.98}
+
+FACE_SIZE = 160
+AUDIO_WINDOW = 32000
+
+# Inference-only YOLO call: no runs/ directory, no annotated images, labels or crops. Nothing is
+# written to disk per frame, so there is nothing to clean up afterwards either.
+YOLO_PREDICT_ARGS = dict(verbose=False, save=False, save_txt=False, save_conf=False, save_crop=False, show=False)
+
+
+# --- Loaders ---
+
+def load_yolo(weights, runtime=YOLO_RUNTIME, check=PARITY_CHECK):
+    from ultralytics import YOLO
+
+    if runtime == "eager":
+        return YOLO(weights)
+    try:
+        exported = os.path.splitext(weights)[0] + {"torchscript": ".torchscript", "onnx": ".onnx"}[runtime]
+        if not os.path.exists(exported):
+            # One-time export next to the weights; later starts load the exported file directly
+            print(f"📦 Exporting {weights} to {runtime}...")
+            exported = YOLO(weights).export(format=runtime, dynamic=runtime == "onnx", verbose=False)
+        model = YOLO(exported, task="detect")
+    except Exception as e:
+        print(f"⚠️ YOLO runtime '{runtime}' unavailable ({e!r}), using eager")
+        return YOLO(weights)
+
+    if check and not check_parity("yolo", YOLO(weights), model):
+        return YOLO(weights)
+    print(f"⚡ YOLO running on {runtime}")
+    return model
+
+
+def load_facenet(device, runtime=FACENET_RUNTIME, check=PARITY_CHECK):
+    import torch
+    from facenet_pytorch import InceptionResnetV1
+
+    eager = InceptionResnetV1(pretrained="vggface2").eval().to(device)
+    if runtime == "eager":
+        return eager
+    try:
+        if runtime == "torchscript":
+            example = torch.zeros(1, 3, FACE_SIZE, FACE_SIZE, device=device)
+            with torch.no_grad():
+                model = torch.jit.optimize_for_inference(torch.jit.trace(eager, example))
+        elif runtime == "int8":
+            if str(device) != "cpu":
+                raise ValueError("int8 dynamic quantization only runs on CPU")
+            # Dynamic quantization covers the Linear layers; convolutions stay fp32
+            model = torch.ao.quantization.quantize_dynamic(copy.deepcopy(eager), {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            raise ValueError(f"unknown runtime {runtime}")
+    except Exception as e:
+        print(f"⚠️ FaceNet runtime '{runtime}' unavailable ({e!r}), using eager")
+        return eager
+
+    if check and not check_parity("facenet", eager, model):
+        return eager
+    print(f"⚡ FaceNet running on {runtime}")
+    return model
+
+
+def load_audio_tagger(checkpoint_path, device="cpu", runtime=AUDIO_RUNTIME, check=PARITY_CHECK):
+    import torch
+    from panns_inference import AudioTagging
+
+    eager = AudioTagging(checkpoint_path=checkpoint_path, device=device)
+    if runtime == "eager":
+        return eager
+    try:
+        if runtime != "int8":
+            raise ValueError(f"unknown runtime {runtime}")
+        if str(device) != "cpu":
+            raise ValueError("int8 dynamic quantization only runs on CPU")
+        # Same AudioTagging wrapper, quantized copy of the Cnn14 inside it
+        model = copy.copy(eager)
+        model.model = torch.ao.quantization.quantize_dynamic(eager.model, {torch.nn.Linear}, dtype=torch.qint8)
+    except Exception as e:
+        print(f"⚠️ Cnn14 runtime '{runtime}' unavailable ({e!r}), using eager")
+        return eager
+
+    if check and not check_parity("cnn14", eager, model):
+        return eager
+    print(f"⚡ Cnn14 running on {runtime}")
+    return model
+
+
+# --- Parity check ---
+
+def load_samples(kind, folder=PARITY_SAMPLES, limit=PARITY_MAX_SAMPLES):
+    """
+    Recorded sample inputs for a model: BGR frames for yolo, RGB 160x160 faces for facenet (use face
+    crops there), 1 s windows for cnn14. Only real data counts; an empty list means no check is possible.
+    """
+    if kind == "cnn14":
+        windows = [np.load(path).astype(np.float32).ravel()[:AUDIO_WINDOW] for path in sorted(glob.glob(os.path.join(folder, "*.npy")))]
+        return [np.pad(w, (0, AUDIO_WINDOW - len(w))) for w in windows[:limit]]
+
+    import cv2
+    paths = sorted(glob.glob(os.path.join(folder, "*.jpg")) + glob.glob(os.path.join(folder, "*.png")))[:limit]
+    frames = [frame for frame in (cv2.imread(path) for path in paths) if frame is not None]
+    if kind == "facenet":
+        return [cv2.cvtColor(cv2.resize(frame, (FACE_SIZE, FACE_SIZE)), cv2.COLOR_BGR2RGB) for frame in frames]
+    return frames
+
+
+def yolo_agreement(eager, candidate, frames):
+    """Mean IoU of boxes matched by class (unmatched boxes on either side count as 0)."""
+    scores = []
+    for frame in frames:
+        ref = eager(frame, **YOLO_PREDICT_ARGS)[0].boxes
+        out = candidate(frame, **YOLO_PREDICT_ARGS)[0].boxes
+        ref = list(zip(ref.cls.cpu().numpy().astype(int), ref.xyxy.cpu().numpy()))
+        out = list(zip(out.cls.cpu().numpy().astype(int), out.xyxy.cpu().numpy()))
+        if not ref and not out:
+            scores.append(1.0)
+            continue
+        matched = []
+        for cls, box in ref:
+            candidates = [(box_iou(box, b), j) for j, (c, b) in enumerate(out) if c == cls]
+            if candidates:
+                iou, j = max(candidates)
+                matched.append(iou)
+                out.pop(j)
+        scores.append(sum(matched) / (len(ref) + len(out)))
+    return float(np.mean(scores))
+
+
+def facenet_agreement(eager, candidate, faces):
+    """Worst cosine similarity between eager and candidate embeddings."""
+    import torch
+    device = next(eager.parameters()).device
+    batch = np.stack(faces).astype(np.float32) / 255.0
+    batch = torch.from_numpy(np.transpose(batch, (0, 3, 1, 2))).to(device)
+    with torch.no_grad():
+        ref = eager(batch).cpu().numpy()
+        out = candidate(batch).cpu().numpy()
+    cos = (ref * out).sum(axis=1) / (np.linalg.norm(ref, axis=1) * np.linalg.norm(out, axis=1) + 1e-12)
+    return float(cos.min())
+
+
+def cnn14_agreement(eager, candidate, windows):
+    """1 - largest absolute difference in clip-wise class probabilities."""
+    batch = np.stack(windows)
+    ref, _ = eager.inference(batch)
+    out, _ = candidate.inference(batch)
+    return float(1.0 - np.abs(ref - out).max())
+
+
+AGREEMENT = {"yolo": yolo_agreement, "facenet": facenet_agreement, "cnn14": cnn14_agreement}
+
+
+def check_parity(kind, eager, candidate, samples=None):
+    """
+    True when the candidate agrees with eager on the sample set. Fails closed: without at least
+    PARITY_MIN_SAMPLES real samples there is nothing to vouch for the variant, and eager is kept.
+    """
+    samples = load_samples(kind) if samples is None else samples
+    if len(samples) < PARITY_MIN_SAMPLES:
+        print(f"❌ {kind} parity: {len(samples)} samples in {PARITY_SAMPLES}/ (need {PARITY_MIN_SAMPLES}), keeping eager")
+        return False
+    agreement = AGREEMENT[kind](eager, candidate, samples)
+    ok = agreement >= PARITY_MIN[kind]
+    print(f"{'✅' if ok else '❌'} {kind} parity: {agreement:.4f} on {len(samples)} samples (min {PARITY_MIN[kind]})")
+    return ok
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare an optimized model runtime against eager PyTorch.")
+    parser.add_argument("model", choices=sorted(AGREEMENT))
+    parser.add_argument("--runtime", required=True)
+    parser.add_argument("--weights", default="/app/weights/best.pt", help="YOLO weights / Cnn14 checkpoint")
+    parser.add_argument("--samples", default=PARITY_SAMPLES, help="folder of sample images or .npy audio windows")
+    args = parser.parse_args()
+
+    PARITY_SAMPLES = args.samples
+    samples = load_samples(args.model, args.samples)
+    if args.model == "yolo":
+        ok = check_parity("yolo", load_yolo(args.weights), load_yolo(args.weights, args.runtime, check=False), samples)
+    elif args.model == "facenet":
+        ok = check_parity("facenet", load_facenet("cpu"), load_facenet("cpu", args.runtime, check=False), samples)
+    else:
+        ok = check_parity("cnn14", load_audio_tagger(args.weights), load_audio_tagger(args.weights, "cpu", args.runtime, check=False), samples)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Bounds for the per-session state (can also come from environment variables)
+SESSION_TTL_SEC = float(os.getenv("SESSION_TTL_SEC", "900"))  # drop a session after 15 min without frames
+SESSION_MAX = int(os.getenv("SESSION_MAX", "512"))            # hard cap on live sessions -> bounded memory
+DEFAULT_SESSION = "default"
+
+
+class RingBuffer:
+    """Fixed-size numpy window, used instead of deque(maxlen=N) so a session costs a few bytes per slot."""
+
+    def __init__(self, size, width=1, dtype=np.float32):
+        self.size = size
+        self.data = np.zeros((size, width), dtype=dtype)
+        self.pos = 0    # next slot to write
+        self.count = 0  # filled slots (<= size)
+
+    def append(self, row):
+        self.data[self.pos] = row
+        self.pos = (self.pos + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def window(self):
+        """Filled rows in storage order (cheap, for order-free stats like mean/sum)."""
+        return self.data[:self.count]
+
+    def values(self):
+        """Filled rows oldest -> newest."""
+        if self.count < self.size:
+            return self.data[:self.count]
+        return np.roll(self.data, -self.pos, axis=0)
+
+    def mean(self):
+        return self.window().mean(axis=0)
+
+
+class SessionStore:
+    """
+    Session-keyed state store. State is created lazily by `factory` on first use and
+    evicted when idle for longer than `ttl_sec` or when more than `max_sessions` are live (LRU).
+    """
+
+    def __init__(self, factory, max_sessions=SESSION_MAX, ttl_sec=SESSION_TTL_SEC):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl_sec = ttl_sec
+        self.evicted = 0
+        self._sessions = OrderedDict()  # session_id -> [state, last_seen], least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, session_id=DEFAULT_SESSION):
+        """Returns the state for `session_id`, creating it if needed, and marks it as recently used."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is None:
+                entry = [self.factory(), now]
+            entry[1] = now
+            self._sessions[session_id] = entry
+            self._evict(now)
+        return entry[0]
+
+    def peek(self, session_id):
+        """Returns the state without creating or touching it (None if unknown)."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        return entry[0] if entry else None
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def items(self):
+        """Snapshot of (session_id, state) pairs, least recently used first."""
+        with self._lock:
+            return [(session_id, entry[0]) for session_id, entry in self._sessions.items()]
+
+    def _evict(self, now):
+        # Entries are kept in LRU order, so only the head can be stale or over the cap
+        while self._sessions:
+            _, (_, last_seen) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - last_seen <= self.ttl_sec:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        return {"sessions": len(self._sessions), "max_sessions": self.max_sessions,
+                "ttl_sec": self.ttl_sec, "evicted": self.evicted}
@@ -0,0 +1,67 @@
+import asyncio
+import contextvars
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# Default pool sizing (can also come from environment variables)
+MODEL_WORKERS = int(os.getenv("MODEL_WORKERS", "1"))              # model instances per pool
+MODEL_QUEUE_LIMIT = int(os.getenv("MODEL_QUEUE_LIMIT", "32"))     # waiting jobs before we answer "queue full"
+
+
+class QueueFull(Exception):
+    """Raised instead of queueing work the pool could not start in reasonable time."""
+
+
+class ModelPool:
+    """
+    Bounded pool of worker threads for blocking model calls. Each worker owns one instance
+    built by `factory`, so no instance is ever used by two threads at once and the asyncio
+    event loop (health checks, uploads, other sessions) never waits on inference.
+    Instances may still share the weights underneath (identity_service's model registry);
+    whatever they share has to be thread-safe or locked by its owner.
+    """
+
+    def __init__(self, factory, workers=MODEL_WORKERS, queue_limit=MODEL_QUEUE_LIMIT, name="model"):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue_limit = queue_limit
+        self.instances = [factory() for _ in range(self.workers)]
+        self._free = queue.SimpleQueue()
+        for instance in self.instances:
+            self._free.put(instance)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self.in_flight = 0  # running + waiting jobs
+        self.rejected = 0
+
+    def _call(self, fn, args):
+        instance = self._free.get()
+        try:
+            return fn(instance, *args)
+        finally:
+            self._free.put(instance)
+
+    async def submit(self, fn, *args):
+        """
+        Runs fn(instance, *args) on a free worker. Raises QueueFull when the backlog is at its limit.
+        The call runs in a copy of the caller's context, so stages timed on the worker still land
+        in the request's x-stage-timings breakdown.
+        """
+        if self.in_flight >= self.workers + self.queue_limit:
+            self.rejected += 1
+            raise QueueFull(f"{self.name} queue is full")
+        self.in_flight += 1
+        try:
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, context.run, self._call, fn, args)
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        """Stop accepting work; jobs already running finish on their own."""
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {"workers": self.workers, "queue_limit": self.queue_limit,
+                "in_flight": self.in_flight, "rejected": self.rejected}
@@ -0,0 +1,11 @@
+"""
+pytest setup for the service tests (run from Backend/: `python -m pytest`).
+
+Each service imports its own modules flat (`from audio_module import ...`) and the shared ones as
+`common.*`, exactly as inside its container, so Backend/ has to be importable; pytest puts each
+test file's service directory on sys.path itself.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
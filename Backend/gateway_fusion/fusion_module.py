@@ -1,6 +1,32 @@
 import numpy as np
-from dataclasses import dataclass
-from collections import deque
+from dataclasses import dataclass, astuple
+from common.session_store import SessionStore, RingBuffer, DEFAULT_SESSION
+
+# Column order of a feature row (the FusionFeatures fields, minus `stale`)
+FEATURE_FIELDS = ("audio_t2", "audio_t5", "audio_conf",
+                  "vis_phone", "vis_multi", "vis_miss",
+                  "id_dom", "id_switch", "id_unkn",
+                  "gaze_off", "gaze_turn")
+F = {name: i for i, name in enumerate(FEATURE_FIELDS)}
+
+WEIGHT_KEYS = ("phone", "identity", "gaze", "audio", "presence")
+DEFAULT_WEIGHTS = {"phone": 0.35, "identity": 0.25, "gaze": 0.15, "audio": 0.15, "presence": 0.10}
+
+# Instant rules on the current frame, then escalation on the mean of the last HISTORY_SIZE scores
+DEFAULT_THRESHOLDS = {"auto_fail": 0.8, "critical": 0.5, "violation": 80, "high_risk": 50, "suspicious": 25}
+HISTORY_SIZE = 10
+
+# Status codes, ordered by severity
+STATUSES = (
+    ("CLEAN", ""),
+    ("SUSPICIOUS", "Inconsistent focus"),
+    ("HIGH_RISK", "Multiple minor flags raised"),
+    ("VIOLATION", "Sustained suspicious behavior"),
+    ("CRITICAL", "Multiple People"),
+    ("AUTO_FAIL", "Identity Mismatch"),
+)
+STATUS_CODE = {name: code for code, (name, _) in enumerate(STATUSES)}
+
 
 @dataclass
 class FusionFeatures:
@@ -8,40 +34,88 @@ class FusionFeatures:
     vis_phone: float; vis_multi: float; vis_miss: float
     id_dom: float; id_switch: float; id_unkn: float
     gaze_off: float; gaze_turn: float
+    stale: tuple = ()  # backends that missed their deadline; their values are the session's last known ones
+
+    def to_array(self):
+        return np.array(astuple(self)[:len(FEATURE_FIELDS)], dtype=np.float64)
+
+
+# --- Scoring: one definition for the live model and for replay.py ---
+# Everything works on feature arrays of any leading shape (..., 11): one frame live, (sessions, frames) in replay.
+
+def weight_vector(weights):
+    """dict -> (5,) array, or (K, 5) array of K weight sets as is"""
+    if isinstance(weights, dict):
+        return np.array([weights[k] for k in WEIGHT_KEYS], dtype=np.float64)
+    return np.asarray(weights, dtype=np.float64)
+
+
+def risk_components(X):
+    """(..., 11) features -> (..., 5) risk terms in WEIGHT_KEYS order."""
+    # 1. Identity Risk with internal 1.0 cap (prevents overflow)
+    id_risk = np.minimum((1.0 - X[..., F["id_dom"]]) + X[..., F["id_switch"]] + X[..., F["id_unkn"]], 1.0)
+    return np.stack([
+        X[..., F["vis_phone"]],
+        id_risk,
+        np.maximum(X[..., F["gaze_off"]], X[..., F["gaze_turn"]]),
+        np.maximum(X[..., F["audio_t2"]], X[..., F["audio_t5"]]),
+        np.maximum(X[..., F["vis_multi"]], X[..., F["vis_miss"]]),
+    ], axis=-1)
+
+
+def risk_scores(components, weights):
+    """
+    (..., 5) risk terms -> integer 0-100 scores (...). With (K, 5) weights the result gets a
+    trailing K axis, one score per weight set.
+    """
+    w = weight_vector(weights)
+    c = components[..., None, :] if w.ndim == 2 else components
+    # 2. Weighted Sum (max logic and proper isolation), summed term by term in a fixed order
+    risk = c[..., 0] * w[..., 0]
+    for i in range(1, len(WEIGHT_KEYS)):
+        risk = risk + c[..., i] * w[..., i]
+    return np.clip(risk * 100, 0, 100).astype(np.int64)
+
+
+def rolling_mean(scores, window=HISTORY_SIZE):
+    """Mean of the last `window` scores along the last axis, over however many exist so far."""
+    csum = np.cumsum(scores, axis=-1, dtype=np.float64)
+    lagged = np.zeros_like(csum)
+    lagged[..., window:] = csum[..., :-window]
+    count = np.minimum(np.arange(1, scores.shape[-1] + 1), window)
+    return (csum - lagged) / count
+
+
+def status_codes(id_unkn, vis_multi, avg, thresholds=DEFAULT_THRESHOLDS):
+    """Escalation status (index into STATUSES) from the current frame's flags and the score average."""
+    return np.select(
+        [id_unkn > thresholds["auto_fail"],
+         vis_multi > thresholds["critical"],
+         avg > thresholds["violation"],
+         avg > thresholds["high_risk"],
+         avg > thresholds["suspicious"]],
+        [STATUS_CODE["AUTO_FAIL"], STATUS_CODE["CRITICAL"], STATUS_CODE["VIOLATION"],
+         STATUS_CODE["HIGH_RISK"], STATUS_CODE["SUSPICIOUS"]],
+        STATUS_CODE["CLEAN"],
+    )
+
 
 class TemporalBehaviorFusionModel:
-    def __init__(self):
-        self.weights = {"phone": 0.35, "identity": 0.25, "gaze": 0.15, "audio": 0.15, "presence": 0.10}
-        self.score_history = deque(maxlen=10)
-
-    def calculate_risk(self, f: FusionFeatures) -> int:
-        # 1. Identity Risk with internal 1.0 cap (prevents overflow)
-        id_risk = min((1.0 - f.id_dom) + f.id_switch + f.id_unkn, 1.0)
-        
-        # 2. Weighted Sum (max logic and proper isolation)
-        risk = (self.weights["phone"]    * f.vis_phone + 
-                self.weights["identity"] * id_risk +
-                self.weights["gaze"]     * max(f.gaze_off, f.gaze_turn) +
-                self.weights["audio"]    * max(f.audio_t2, f.audio_t5) +
-                self.weights["presence"] * max(f.vis_multi, f.vis_miss))
-        
-        score = int(np.clip(risk * 100, 0, 100))
-        self.score_history.append(score)
+    def __init__(self, weights=None, thresholds=None):
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.thresholds = dict(thresholds or DEFAULT_THRESHOLDS)
+        # Last 10 risk scores per exam session
+        self.sessions = SessionStore(lambda: RingBuffer(HISTORY_SIZE, 1, np.uint8))
+
+    def calculate_risk(self, f: FusionFeatures, session_id: str = DEFAULT_SESSION) -> int:
+        score = int(risk_scores(risk_components(f.to_array()), self.weights))
+        self.sessions.get(session_id).append(score)
         return score
 
-    def get_violation_status(self, f: FusionFeatures):
-        # Instant Failure Rules
-        if f.id_unkn > 0.8: return "AUTO_FAIL", "Identity Mismatch"
-        if f.vis_multi > 0.5: return "CRITICAL", "Multiple People"
-        
-        # Temporal Logic
-        if not self.score_history: return "CLEAN", ""
-        
-        avg = sum(self.score_history) / len(self.score_history)
-
-        # Escalation Path
-        if avg > 80: return "VIOLATION", "Sustained suspicious behavior"
-        if avg > 50: return "HIGH_RISK", "Multiple minor flags raised"
-        if avg > 25: return "SUSPICIOUS", "Inconsistent focus"
-        
-        return "CLEAN", ""
\ No newline at end of file
+    def get_violation_status(self, f: FusionFeatures, session_id: str = DEFAULT_SESSION):
+        # Temporal Logic (no history yet -> average 0 -> only the instant rules can fire)
+        score_history = self.sessions.peek(session_id)
+        avg = float(score_history.mean()[0]) if score_history is not None and len(score_history) else 0.0
+
+        # Instant Failure Rules, then the Escalation Path
+        return STATUSES[int(status_codes(f.id_unkn, f.vis_multi, avg, self.thresholds))]
@@ -1,13 +1,20 @@
 import httpx
 import asyncio
+import time
+import random
 import cv2
 import numpy as np
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fusion_module import TemporalBehaviorFusionModel, FusionFeatures
+from fusion_module import TemporalBehaviorFusionModel, FusionFeatures, STATUS_CODE
+from telemetry import TelemetryRecorder
+from common.metrics import metrics, instrument, STAGE_HEADER
+from common.session_store import SessionStore, DEFAULT_SESSION
 import os  # env vars
+import json
 
 app = FastAPI()
+instrument(app)  # /metrics
 fusion_model = TemporalBehaviorFusionModel()
 
 # Allow your frontend to communicate with the backend
@@ -22,29 +29,174 @@ app.add_middleware(
 # Service URLs (Internal Docker Network names)
 
 # URLs can also come from environment variables
-VISION_URL = os.getenv("VISION_URL", "http://vision:8001/process")
-IDENTITY_URL = os.getenv("IDENTITY_URL", "http://identity:8002/process")
+# Frames are forwarded as raw JPEG bodies (the *_raw endpoints), not re-wrapped in multipart forms
+VISION_URL = os.getenv("VISION_URL", "http://vision:8001/process_raw")
+IDENTITY_URL = os.getenv("IDENTITY_URL", "http://identity:8002/process_raw")
 AUDIO_URL = os.getenv("AUDIO_URL", "http://audio:8003/get_features")
 
+# "shared": vision runs YOLO once and forwards the face box to identity (one detector pass per frame)
+# "parallel": vision and identity each run their own detector on the frame, concurrently
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "shared")
+
+# Per-backend deadlines (seconds). A backend that misses its budget is replaced by the
+# session's last known values instead of holding up the verdict.
+DEADLINES = {
+    "vision": float(os.getenv("VISION_DEADLINE_MS", "1500")) / 1000,
+    "identity": float(os.getenv("IDENTITY_DEADLINE_MS", "1500")) / 1000,
+    "audio": float(os.getenv("AUDIO_DEADLINE_MS", "300")) / 1000,
+}
+
+# Used when a backend fails before we ever heard from it for this session.
+# "No evidence" values: a slow service must never look like cheating (e.g. id_unkn=1 -> AUTO_FAIL).
+NEUTRAL = {
+    "vision": [0.0, 0.0, 0.0, 0.0, 0.0],   # [phone, multi, missing, gaze_off, gaze_turn]
+    "identity": [1.0, 0.0, 0.0],           # [dom, switch, unkn]
+    "audio": [0.0, 0.0, 0.0],              # [t2, t5, conf]
+}
+
+# Last good response of every backend, per session
+last_known = SessionStore(dict)
+
+# One long-lived pooled client (keep-alive connections to every backend)
+client: httpx.AsyncClient = None
+
+# Every verdict is recorded off the request path (TELEMETRY_DIR, empty to disable)
+recorder = TelemetryRecorder()
+
+# Fraction of /analyze requests that come back with a full stage breakdown (gateway + every backend)
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", "0"))
+
+metrics.gauge("sessions", lambda: len(last_known))
+metrics.gauge("telemetry_queued", lambda: recorder.queue.qsize())
+metrics.gauge("telemetry_dropped", lambda: recorder.dropped)
+
+
+@app.on_event("startup")
+async def open_client():
+    global client
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(max(DEADLINES.values())),
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "200")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "50")),
+            keepalive_expiry=30,
+        ),
+    )
+    recorder.start()
+
+
+@app.on_event("shutdown")
+async def close_client():
+    await client.aclose()
+    recorder.stop()
+
+
+async def call_backend(name, request, timings=None, breakdown=None):
+    """
+    Awaits one backend call within its deadline. Returns the JSON body, or None on timeout/error.
+    The call's wall time (ms) goes into timings[name] when a dict is passed, and the backend's own
+    stage breakdown (sampled requests only) into breakdown[name].
+    """
+    start = time.perf_counter()
+    try:
+        res = await asyncio.wait_for(request, DEADLINES[name])
+        res.raise_for_status()
+        if breakdown is not None and STAGE_HEADER in res.headers:
+            breakdown[name] = json.loads(res.headers[STAGE_HEADER])
+        return res.json()
+    except (asyncio.TimeoutError, httpx.HTTPError, ValueError) as e:
+        metrics.inc(f"{name}_failures")
+        print(f"⚠️ {name} backend unavailable: {e!r}")
+        return None
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        metrics.observe(name, elapsed)
+        if timings is not None:
+            timings[name] = elapsed
+
+
+async def shared_detection(contents, session_id, timings, headers=None, breakdown=None):
+    """Vision first, then identity reuses vision's face box instead of running YOLO again."""
+    v_out = await call_backend("vision", client.post(
+        VISION_URL, content=contents, params={"session_id": session_id, "return_face": "true"},
+        headers=headers), timings, breakdown)
+    if v_out is None:
+        # No box to share -> identity falls back to its own detector
+        id_data = await call_backend("identity", client.post(
+            IDENTITY_URL, content=contents, params={"session_id": session_id}, headers=headers), timings, breakdown)
+        return None, id_data
+    id_data = await call_backend("identity", client.post(IDENTITY_URL, content=contents, params={
+        "session_id": session_id,
+        "face_box": json.dumps(v_out["face_box"]),
+        "num_boxes": str(v_out["num_boxes"]),
+    }, headers=headers), timings, breakdown)
+    return v_out["features"], id_data
+
+
 @app.post("/analyze")
-async def analyze_session(file: UploadFile = File(...)):
+async def analyze_session(file: UploadFile = File(...), session_id: str = Form(DEFAULT_SESSION),
+                          timings: bool = Form(False)):
     # 1. Read the uploaded frame
     contents = await file.read()
-    
+    return await analyze_frame(contents, session_id, timings)
+
+
+@app.websocket("/ws/{session_id}")
+async def analyze_stream(websocket: WebSocket, session_id: str):
+    """
+    Persistent per-session stream: the client sends each JPEG frame as a binary message and
+    gets the same {risk_score, status, message, stale} JSON back for every frame.
+    """
+    await websocket.accept()
+    try:
+        while True:
+            contents = await websocket.receive_bytes()
+            await websocket.send_json(await analyze_frame(contents, session_id))
+    except WebSocketDisconnect:
+        pass
+
+
+async def analyze_frame(contents, session_id, include_timings=False):
+    start = time.perf_counter()
+    timings = {}  # per-stage wall time (ms), recorded with the verdict
+
+    # Sampled requests ask every backend for its internal stage breakdown too
+    sampled = include_timings or random.random() < METRICS_SAMPLE_RATE
+    headers = {STAGE_HEADER: "1"} if sampled else None
+    breakdown = {} if sampled else None
+
     # 2. Parallel Execution: Send frame to Vision and Identity simultaneously
-    async with httpx.AsyncClient(timeout=None) as client:
+    # Every worker keeps its temporal window per session_id
+    audio_task = call_backend("audio", client.get(
+        AUDIO_URL, params={"session_id": session_id}, headers=headers), timings, breakdown)
+
+    if PIPELINE_MODE == "shared":
+        # Audio runs alongside the vision -> identity chain
+        (v_data, id_data), a_data = await asyncio.gather(
+            shared_detection(contents, session_id, timings, headers, breakdown), audio_task)
+    else:
         # We fire these requests in parallel to save time
-        vision_task = client.post(VISION_URL, files={"file": contents})
-        identity_task = client.post(IDENTITY_URL, files={"file": contents})
-        audio_task = client.get(AUDIO_URL)
+        vision_task = call_backend("vision", client.post(
+            VISION_URL, content=contents, params={"session_id": session_id}, headers=headers), timings, breakdown)
+        identity_task = call_backend("identity", client.post(
+            IDENTITY_URL, content=contents, params={"session_id": session_id}, headers=headers), timings, breakdown)
 
         # Wait for all workers to respond
-        v_res, id_res, a_res = await asyncio.gather(vision_task, identity_task, audio_task)
+        v_data, id_data, a_data = await asyncio.gather(vision_task, identity_task, audio_task)
 
-    # 3. Parse Results
-    v_data = v_res.json()   # [phone, multi, missing, gaze_off, gaze_turn]
-    id_data = id_res.json() # [dom, switch, unkn]
-    a_data = a_res.json()   # [t2, t5, conf]
+    # 3. Parse Results, filling missed deadlines from the session's last known values
+    last = last_known.get(session_id)
+    stale = []
+    results = {"vision": v_data, "identity": id_data, "audio": a_data}
+    for name, data in results.items():
+        if data is None:
+            stale.append(name)
+            results[name] = last.get(name, NEUTRAL[name])
+        else:
+            last[name] = data
+    v_data = results["vision"]     # [phone, multi, missing, gaze_off, gaze_turn]
+    id_data = results["identity"]  # [dom, switch, unkn]
+    a_data = results["audio"]      # [t2, t5, conf]
 
     # 4. Map to Fusion Features
     # Order: audio(3), vis(3), id(3), gaze(2)
@@ -52,18 +204,41 @@ async def analyze_session(file: UploadFile = File(...)):
         audio_t2=a_data[0], audio_t5=a_data[1], audio_conf=a_data[2],
         vis_phone=v_data[0], vis_multi=v_data[1], vis_miss=v_data[2],
         id_dom=id_data[0], id_switch=id_data[1], id_unkn=id_data[2],
-        gaze_off=v_data[3], gaze_turn=v_data[4]
+        gaze_off=v_data[3], gaze_turn=v_data[4],
+        stale=tuple(stale)
     )
 
     # 5. Run Fusion Logic
-    risk_score = fusion_model.calculate_risk(features)
-    status, message = fusion_model.get_violation_status(features)
+    fusion_start = time.perf_counter()
+    risk_score = fusion_model.calculate_risk(features, session_id)
+    status, message = fusion_model.get_violation_status(features, session_id)
+    timings["fusion"] = (time.perf_counter() - fusion_start) * 1000
+    timings["total"] = (time.perf_counter() - start) * 1000
+    metrics.observe("fusion", timings["fusion"])
+    metrics.observe("total", timings["total"])
 
-    return {
+    # 6. Keep it for audits / replay (queued, written by the recorder thread)
+    recorder.record(session_id, features, risk_score, STATUS_CODE[status], timings)
+
+    verdict = {
         "risk_score": risk_score,
         "status": status,
-        "message": message
+        "message": message,
+        "stale": list(features.stale)
     }
+    if sampled:
+        # Per-stage breakdown in ms: the gateway's view plus each backend's internal stages
+        verdict["timings"] = timings
+        verdict["stages"] = breakdown
+    return verdict
+
+@app.get("/health")
+async def health():
+    return {"status": "ready"}
+
+@app.get("/telemetry_stats")
+async def telemetry_stats():
+    return recorder.stats()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,164 @@
+"""
+Offline replay of recorded fusion features: scores every frame of every session at once with the
+same scoring code the live gateway uses (fusion_module), so weights and thresholds can be swept
+without running exams.
+
+Recordings:
+  - .npz with `features` (sessions, frames, 11) in FEATURE_FIELDS order, optional `lengths` (sessions,)
+    for sessions shorter than the padded frame axis, and optional `labels` (sessions,) 1 = cheated
+  - .jsonl with one frame per line: {"session_id": ..., "audio_t2": ..., ..., "gaze_turn": ...}
+    (frames in recording order; an optional per-line "label" marks the session)
+  - a telemetry directory written by the gateway's recorder (telemetry.py)
+
+Usage:
+  python replay.py recordings.npz
+  python replay.py recordings.npz --weights phone=0.3,0.35,0.4 identity=0.2,0.25 --thresholds violation=70,80
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from collections import defaultdict
+import numpy as np
+from fusion_module import (FEATURE_FIELDS, F, WEIGHT_KEYS, DEFAULT_WEIGHTS, DEFAULT_THRESHOLDS, HISTORY_SIZE,
+                           STATUSES, STATUS_CODE, risk_components, risk_scores, rolling_mean, status_codes)
+
+
+class Recording:
+    """Padded (sessions, frames, 11) features plus a validity mask."""
+
+    def __init__(self, features, lengths=None, labels=None):
+        self.features = np.asarray(features, dtype=np.float64)
+        n_sessions, n_frames = self.features.shape[:2]
+        self.lengths = np.full(n_sessions, n_frames) if lengths is None else np.asarray(lengths)
+        self.mask = np.arange(n_frames) < self.lengths[:, None]
+        self.labels = None if labels is None else np.asarray(labels).astype(bool)
+
+    @classmethod
+    def load(cls, path):
+        if os.path.isdir(path):
+            return cls.from_telemetry(path)
+        if path.endswith(".npz"):
+            data = np.load(path)
+            return cls(data["features"], data.get("lengths"), data.get("labels"))
+
+        frames, labels = defaultdict(list), {}
+        with open(path) as f:
+            for line in f:
+                if not line.strip(): continue
+                row = json.loads(line)
+                frames[row["session_id"]].append([row[name] for name in FEATURE_FIELDS])
+                if "label" in row:
+                    labels[row["session_id"]] = row["label"]
+        ids = list(frames)
+        lengths = np.array([len(frames[s]) for s in ids])
+        features = np.zeros((len(ids), lengths.max() if len(ids) else 0, len(FEATURE_FIELDS)))
+        for i, s in enumerate(ids):
+            features[i, :lengths[i]] = frames[s]
+        return cls(features, lengths, [labels.get(s, 0) for s in ids] if labels else None)
+
+    @classmethod
+    def from_telemetry(cls, root):
+        from telemetry import TelemetryReader
+
+        data = TelemetryReader(root).load(["ts", "session_id", *FEATURE_FIELDS])
+        if not data:
+            return cls(np.zeros((0, 0, len(FEATURE_FIELDS))))
+        # Group rows by session, keeping recording order inside each session
+        order = np.lexsort((data["ts"], data["session_id"]))
+        ids, starts, lengths = np.unique(data["session_id"][order], return_index=True, return_counts=True)
+        rows = np.stack([data[name][order] for name in FEATURE_FIELDS], axis=1)
+        features = np.zeros((len(ids), lengths.max(), len(FEATURE_FIELDS)))
+        for i, (start, n) in enumerate(zip(starts, lengths)):
+            features[i, :n] = rows[start:start + n]
+        return cls(features, lengths)
+
+
+class ReplayEngine:
+    def __init__(self, recording):
+        self.recording = recording
+        # Weight-independent parts, computed once for the whole sweep
+        self.components = risk_components(recording.features)
+        self.id_unkn = recording.features[..., F["id_unkn"]]
+        self.vis_multi = recording.features[..., F["vis_multi"]]
+
+    def averages(self, weights):
+        """Rolling score average per frame (sessions, frames), the input of the escalation path."""
+        # Padding after the end of a session never reaches its frames: the mean only looks back
+        return rolling_mean(risk_scores(self.components, weights), HISTORY_SIZE)
+
+    def statuses(self, weights, thresholds, avg=None):
+        """Per-frame status codes (sessions, frames), exactly as the live gateway would have returned them."""
+        avg = self.averages(weights) if avg is None else avg
+        codes = status_codes(self.id_unkn, self.vis_multi, avg, thresholds)
+        return np.where(self.recording.mask, codes, STATUS_CODE["CLEAN"])
+
+    def evaluate(self, weights, thresholds, flag_at="VIOLATION", avg=None):
+        """Session-level summary: worst status reached, flag rate and (with labels) precision/recall."""
+        worst = self.statuses(weights, thresholds, avg).max(axis=1)
+        flagged = worst >= STATUS_CODE[flag_at]
+        result = {
+            "weights": dict(weights),
+            "thresholds": dict(thresholds),
+            "flag_rate": float(flagged.mean()) if len(flagged) else 0.0,
+            "worst": {name: int((worst == code).sum()) for code, (name, _) in enumerate(STATUSES)},
+        }
+        labels = self.recording.labels
+        if labels is not None:
+            tp = int((flagged & labels).sum())
+            precision = tp / max(int(flagged.sum()), 1)
+            recall = tp / max(int(labels.sum()), 1)
+            result.update(precision=precision, recall=recall,
+                          f1=2 * precision * recall / (precision + recall) if tp else 0.0)
+        return result
+
+    def sweep(self, weight_grid, threshold_grid, flag_at="VIOLATION"):
+        """Every combination of the two grids -> list of evaluate() results."""
+        results = []
+        for w in weight_grid:
+            avg = self.averages(w)  # thresholds don't change the scores
+            results.extend(self.evaluate(w, t, flag_at, avg) for t in threshold_grid)
+        return results
+
+
+def grid(defaults, overrides):
+    """{"phone": [0.3, 0.4]} over the defaults -> list of every combination (as dicts)"""
+    keys = list(defaults)
+    values = [overrides.get(k, [defaults[k]]) for k in keys]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def parse_grid(specs, allowed):
+    """["phone=0.3,0.35", ...] -> {"phone": [0.3, 0.35]}"""
+    out = {}
+    for spec in specs or []:
+        key, _, values = spec.partition("=")
+        if key not in allowed:
+            raise SystemExit(f"Unknown key '{key}', expected one of {', '.join(allowed)}")
+        out[key] = [float(v) for v in values.split(",")]
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded fusion features and sweep weights/thresholds.")
+    parser.add_argument("recording", help=".npz or .jsonl feature recording")
+    parser.add_argument("--weights", nargs="*", help=f"key=v1,v2,... for {', '.join(WEIGHT_KEYS)}")
+    parser.add_argument("--thresholds", nargs="*", help=f"key=v1,v2,... for {', '.join(DEFAULT_THRESHOLDS)}")
+    parser.add_argument("--flag-at", default="VIOLATION", choices=[name for name, _ in STATUSES],
+                        help="a session counts as flagged once it reaches this status")
+    parser.add_argument("--top", type=int, default=10, help="how many configurations to print")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    engine = ReplayEngine(Recording.load(args.recording))
+    weight_grid = grid(DEFAULT_WEIGHTS, parse_grid(args.weights, WEIGHT_KEYS))
+    threshold_grid = grid(DEFAULT_THRESHOLDS, parse_grid(args.thresholds, DEFAULT_THRESHOLDS))
+    results = engine.sweep(weight_grid, threshold_grid, args.flag_at)
+    elapsed = time.perf_counter() - start
+
+    n_sessions, n_frames = engine.recording.mask.shape
+    print(f"⏱️ {len(results)} configurations x {n_sessions} sessions ({int(engine.recording.mask.sum())} frames) in {elapsed:.2f}s")
+    key = "f1" if engine.recording.labels is not None else "flag_rate"
+    for r in sorted(results, key=lambda r: r[key], reverse=key == "f1")[:args.top]:
+        print(json.dumps(r))
@@ -0,0 +1,241 @@
+"""
+Verdict recorder: every /analyze result (features, risk score, status, per-stage timings) is kept
+on disk for audits and offline tools such as replay.py.
+
+The request path only puts a tuple on an in-memory queue. A background thread turns the queue
+into columns and appends them to one raw fixed-width file per column:
+
+    telemetry/<segment>/schema.json     column name -> numpy dtype
+    telemetry/<segment>/<column>.bin    raw little-endian values, one per recorded frame
+
+A new segment starts every TELEMETRY_SEGMENT_SEC seconds or TELEMETRY_SEGMENT_ROWS rows. Each
+column file can be np.memmap'ed directly; TelemetryReader does that for you.
+"""
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+from fusion_module import FEATURE_FIELDS
+
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", "telemetry")  # empty = recording off
+TELEMETRY_FLUSH_SEC = float(os.getenv("TELEMETRY_FLUSH_SEC", "1.0"))
+TELEMETRY_SEGMENT_SEC = float(os.getenv("TELEMETRY_SEGMENT_SEC", "3600"))
+TELEMETRY_SEGMENT_ROWS = int(os.getenv("TELEMETRY_SEGMENT_ROWS", "1000000"))
+TELEMETRY_QUEUE_MAX = int(os.getenv("TELEMETRY_QUEUE_MAX", "100000"))  # beyond this, rows are dropped, never waited on
+
+SESSION_BYTES = 64  # session ids are stored fixed-width (longer ids are truncated)
+STAGES = ("vision", "identity", "audio", "fusion", "total")
+STALE_BITS = {"vision": 1, "identity": 2, "audio": 4}
+
+SCHEMA = {
+    "ts": "<f8",
+    "session_id": f"S{SESSION_BYTES}",
+    **{name: "<f4" for name in FEATURE_FIELDS},
+    "stale": "u1",        # bitmask of STALE_BITS
+    "risk_score": "u1",
+    "status": "u1",       # index into fusion_module.STATUSES
+    **{f"{stage}_ms": "<f4" for stage in STAGES},  # NaN when the stage didn't run
+}
+
+
+def session_key(session_id):
+    """UTF-8 session id cut to SESSION_BYTES on a character boundary (never half a character)."""
+    return session_id.encode()[:SESSION_BYTES].decode("utf-8", "ignore").encode()
+
+
+class TelemetryRecorder:
+    def __init__(self, root=TELEMETRY_DIR, flush_sec=TELEMETRY_FLUSH_SEC,
+                 segment_sec=TELEMETRY_SEGMENT_SEC, segment_rows=TELEMETRY_SEGMENT_ROWS):
+        self.root = root
+        self.enabled = bool(root)
+        self.flush_sec = flush_sec
+        self.segment_sec = segment_sec
+        self.segment_rows = segment_rows
+        self.queue = queue.Queue(maxsize=TELEMETRY_QUEUE_MAX)
+        self.recorded = 0
+        self.dropped = 0
+        self.segment = None
+        self.segment_started = 0.0
+        self.segment_count = 0
+        self.files = {}
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        if not self.enabled or self.thread is not None:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Flushes everything still queued and closes the segment."""
+        if self.thread is None:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
+        self._close_segment()
+
+    def record(self, session_id, features, risk_score, status_code, timings):
+        """Called on the request path: O(1), no I/O, never blocks."""
+        if not self.enabled:
+            return
+        try:
+            self.queue.put_nowait((time.time(), session_id, features, risk_score, status_code, timings))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            time.sleep(self.flush_sec if self.running else 0)
+            rows = []
+            try:
+                while True:
+                    rows.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if rows:
+                try:
+                    self._write(rows)
+                except OSError as e:
+                    self.dropped += len(rows)
+                    print(f"⚠️ Telemetry write failed: {e!r}")
+
+    def _columns(self, rows):
+        n = len(rows)
+        cols = {name: np.empty(n, dtype=dtype) for name, dtype in SCHEMA.items()}
+        for i, (ts, session_id, f, risk_score, status_code, timings) in enumerate(rows):
+            cols["ts"][i] = ts
+            cols["session_id"][i] = session_key(session_id)
+            for name in FEATURE_FIELDS:
+                cols[name][i] = getattr(f, name)
+            cols["stale"][i] = sum(STALE_BITS[name] for name in f.stale)
+            cols["risk_score"][i] = risk_score
+            cols["status"][i] = status_code
+            for stage in STAGES:
+                cols[f"{stage}_ms"][i] = timings.get(stage, np.nan)
+        return cols
+
+    def _write(self, rows):
+        cols = self._columns(rows)
+        if (self.segment is None or time.time() - self.segment_started > self.segment_sec
+                or self.segment_count >= self.segment_rows):
+            self._open_segment()
+        try:
+            for name, values in cols.items():
+                self.files[name].write(values.tobytes())
+                self.files[name].flush()
+        except OSError:
+            self._rollback()
+            raise
+        self.segment_count += len(rows)
+        self.recorded += len(rows)
+
+    def _rollback(self):
+        """
+        A batch failed part-way: some columns already hold its rows, others don't. Cut every column
+        back to the last committed row so later rows stay aligned; if even that fails, abandon the
+        segment (its columns only differ at the tail, which load_segment trims) and start a new one.
+        """
+        self._close_segment(ignore_errors=True)
+        try:
+            for name in SCHEMA:
+                os.truncate(os.path.join(self.segment, f"{name}.bin"),
+                            self.segment_count * np.dtype(SCHEMA[name]).itemsize)
+            self.files = {name: open(os.path.join(self.segment, f"{name}.bin"), "ab") for name in SCHEMA}
+        except OSError as e:
+            print(f"⚠️ Telemetry segment {self.segment} abandoned: {e!r}")
+            self._close_segment(ignore_errors=True)
+            self.segment = None
+
+    def _open_segment(self):
+        self._close_segment()
+        self.segment_started = time.time()
+        name = time.strftime("%Y%m%d-%H%M%S", time.gmtime(self.segment_started))
+        self.segment = os.path.join(self.root, name)
+        # Never reopen an existing segment (an abandoned one may have misaligned columns)
+        suffix = 1
+        while os.path.exists(self.segment):
+            self.segment = os.path.join(self.root, f"{name}-{suffix}")
+            suffix += 1
+        os.makedirs(self.segment)
+        with open(os.path.join(self.segment, "schema.json"), "w") as f:
+            json.dump(SCHEMA, f)
+        self.files = {name: open(os.path.join(self.segment, f"{name}.bin"), "ab") for name in SCHEMA}
+        self.segment_count = 0
+
+    def _close_segment(self, ignore_errors=False):
+        for f in self.files.values():
+            try:
+                f.close()
+            except OSError:
+                if not ignore_errors:
+                    raise
+        self.files = {}
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "segment": self.segment,
+        }
+
+
+class TelemetryReader:
+    """Read side: memory-maps segment columns, no text parsing."""
+
+    def __init__(self, root=TELEMETRY_DIR):
+        self.root = root
+
+    def segments(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.path.join(self.root, d) for d in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, d, "schema.json")))
+
+    def load_segment(self, segment, columns=None):
+        """{column: np.memmap} for one segment (trimmed to the rows every column has)."""
+        with open(os.path.join(segment, "schema.json")) as f:
+            schema = json.load(f)
+        columns = columns or list(schema)
+        out = {}
+        for name in columns:
+            path = os.path.join(segment, f"{name}.bin")
+            dtype = np.dtype(schema[name])
+            n = os.path.getsize(path) // dtype.itemsize
+            out[name] = np.memmap(path, dtype=dtype, mode="r", shape=(n,)) if n else np.empty(0, dtype)
+        rows = min(len(v) for v in out.values())  # a crash mid-flush can leave one column longer
+        return {name: v[:rows] for name, v in out.items()}
+
+    def load(self, columns=None):
+        """All segments concatenated (copies into memory)."""
+        parts = [self.load_segment(s, columns) for s in self.segments()]
+        if not parts:
+            return {}
+        return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+    def session(self, session_id, columns=None):
+        """One session's timeline across all segments, in recording order."""
+        key = session_key(session_id)
+        parts = []
+        for segment in self.segments():
+            ids = self.load_segment(segment, ["session_id"])["session_id"]
+            idx = np.flatnonzero(ids == key)
+            if len(idx):
+                data = self.load_segment(segment, columns)
+                parts.append({name: np.asarray(v[idx]) for name, v in data.items()})
+        if not parts:
+            return {}
+        return {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+
+    def session_ids(self):
+        ids = set()
+        for segment in self.segments():
+            ids.update(np.unique(self.load_segment(segment, ["session_id"])["session_id"]).tolist())
+        return sorted(i.decode("utf-8", "replace") for i in ids)
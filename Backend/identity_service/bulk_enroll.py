@@ -0,0 +1,68 @@
+"""
+Offline bulk import of a whole cohort.
+
+    python bulk_enroll.py /path/to/cohort [--batch-size 32] [--workers 8] [--no-train]
+
+The source tree uses the same layout as data/students_faces: one folder per student,
+containing that student's photos. Photos are copied into DATA_DIR under content-hash
+names, so re-running an import never duplicates an image. Embedding then goes through
+the batched, cached enrollment pipeline.
+"""
+import argparse
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from embedding_cache import EmbeddingCache
+from enrollment_utils import EnrollmentManager, DATA_DIR, ENROLL_BATCH_SIZE, ENROLL_IO_WORKERS, IMAGE_EXTS
+
+
+def import_image(src, student_name):
+    """Copies one photo into the student's folder. Returns True if it was new."""
+    with open(src, "rb") as f:
+        data = f.read()
+    dst_dir = os.path.join(DATA_DIR, student_name)
+    dst = os.path.join(dst_dir, EmbeddingCache.key(data) + os.path.splitext(src)[1].lower())
+    if os.path.exists(dst):
+        return False
+    os.makedirs(dst_dir, exist_ok=True)
+    shutil.copyfile(src, dst)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-import a directory tree of student photos and train.")
+    parser.add_argument("source", help="directory with one sub-folder of photos per student")
+    parser.add_argument("--batch-size", type=int, default=ENROLL_BATCH_SIZE, help="images per YOLO/FaceNet pass")
+    parser.add_argument("--workers", type=int, default=ENROLL_IO_WORKERS, help="threads for reading/decoding")
+    parser.add_argument("--no-train", action="store_true", help="only copy the photos into DATA_DIR")
+    args = parser.parse_args()
+
+    jobs = []
+    for student_name in sorted(os.listdir(args.source)):
+        student_dir = os.path.join(args.source, student_name)
+        if not os.path.isdir(student_dir): continue
+        for img_name in os.listdir(student_dir):
+            if os.path.splitext(img_name)[1].lower() in IMAGE_EXTS:
+                jobs.append((os.path.join(student_dir, img_name), student_name))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        added = sum(pool.map(lambda job: import_image(*job), jobs))
+    print(f"📥 Imported {added} new photos ({len(jobs) - added} already present) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    if args.no_train:
+        return
+
+    start = time.perf_counter()
+    try:
+        EnrollmentManager().sync_and_train(batch_size=args.batch_size, workers=args.workers)
+    except RuntimeError as e:
+        raise SystemExit(f"❌ {e}")
+    print(f"✅ Bulk enrollment finished in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import pickle
+import numpy as np
+
+try:
+    import hnswlib  # optional: only needed for IDENTITY_BACKEND=ann
+except ImportError:
+    hnswlib = None
+
+# Path Definitions
+SVM_MODEL_PATH = "data/svm_model_facenet.pkl"
+ENCODER_PATH = "data/label_encoder.pkl"
+EMBEDDINGS_PATH = "data/faces_embeddings_facenet.npz"
+
+# "svm": pickled SVC + predict_proba (original behaviour)
+# "gallery": normalized embedding matrix, one matrix-vector product per face
+# "ann": gallery through an HNSW index (hnswlib), for galleries of tens of thousands of students
+IDENTITY_BACKEND = os.getenv("IDENTITY_BACKEND", "svm")
+
+SVM_THRESHOLD = 0.80  # Threshold for recognition (probability)
+GALLERY_THRESHOLD = float(os.getenv("GALLERY_THRESHOLD", "0.70"))          # cosine similarity to accept
+GALLERY_MIN_THRESHOLD = float(os.getenv("GALLERY_MIN_THRESHOLD", "0.55"))  # floor for loosely enrolled students
+
+
+class SvmClassifier:
+    def __init__(self, model, encoder, threshold=SVM_THRESHOLD):
+        self.model = model
+        self.encoder = encoder
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls):
+        model = pickle.load(open(SVM_MODEL_PATH, "rb"))
+        encoder = pickle.load(open(ENCODER_PATH, "rb"))
+        return cls(model, encoder)
+
+    def predict(self, emb):
+        """emb: (B, 512) FaceNet embeddings -> enrolled name or "unknown" per row."""
+        probs = self.model.predict_proba(emb)
+        best = np.argmax(probs, axis=1)
+        labels = ["unknown"] * len(best)
+        for i in np.flatnonzero(probs[np.arange(len(best)), best] > self.threshold):
+            labels[i] = self.encoder.inverse_transform([best[i]])[0]
+        return labels
+
+
+def _normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+class GalleryIndex:
+    """
+    Cosine-similarity gallery: one L2-normalized float32 centroid per enrolled student.
+    Matching a batch of faces is a single (B, 512) x (512, N) product, so adding a student
+    only means adding a row - no classifier retrain.
+    """
+
+    def __init__(self, embeddings, labels, threshold=GALLERY_THRESHOLD, min_threshold=GALLERY_MIN_THRESHOLD, ann=False):
+        X = _normalize(embeddings)
+        self.labels, inverse = np.unique(np.asarray(labels), return_inverse=True)
+
+        centroids = np.zeros((len(self.labels), X.shape[1]), dtype=np.float32)
+        np.add.at(centroids, inverse, X)
+        self.matrix = np.ascontiguousarray(_normalize(centroids))
+
+        # Per-identity threshold: students whose enrollment photos spread out get a looser
+        # (but floored) threshold, tightly enrolled ones keep the global one
+        sims = np.einsum("ij,ij->i", X, self.matrix[inverse])
+        self.thresholds = np.full(len(self.labels), threshold, dtype=np.float32)
+        for k in range(len(self.labels)):
+            own = sims[inverse == k]
+            self.thresholds[k] = np.clip(own.mean() - 2 * own.std(), min_threshold, threshold)
+
+        self.index = None
+        if ann:
+            if hnswlib is None:
+                print("WARNING: hnswlib not installed, IDENTITY_BACKEND=ann falls back to exact gallery matching.")
+            else:
+                self.index = hnswlib.Index(space="ip", dim=self.matrix.shape[1])
+                self.index.init_index(max_elements=len(self.labels), ef_construction=200, M=16)
+                self.index.add_items(self.matrix, np.arange(len(self.labels)))
+                self.index.set_ef(64)
+
+    @classmethod
+    def load(cls, path=EMBEDDINGS_PATH, **kwargs):
+        data = np.load(path)
+        return cls(data["X"], data["Y"], **kwargs)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def search(self, emb):
+        """Best gallery row and its cosine similarity for each embedding."""
+        q = _normalize(np.atleast_2d(emb))
+        if self.index is not None:
+            idx, dist = self.index.knn_query(q, k=1)
+            return idx[:, 0], 1.0 - dist[:, 0]
+        sims = q @ self.matrix.T
+        best = np.argmax(sims, axis=1)
+        return best, sims[np.arange(len(best)), best]
+
+    def predict(self, emb):
+        """emb: (B, 512) FaceNet embeddings -> enrolled name or "unknown" per row."""
+        best, sims = self.search(emb)
+        accepted = sims >= self.thresholds[best]
+        return [str(self.labels[i]) if ok else "unknown" for i, ok in zip(best, accepted)]
+
+
+def load_classifier(backend=IDENTITY_BACKEND):
+    """The configured identity backend, or None when nothing has been enrolled yet."""
+    try:
+        if backend == "svm":
+            return SvmClassifier.load()
+        return GalleryIndex.load(ann=(backend == "ann"))
+    except FileNotFoundError:
+        print(f"CRITICAL: {backend} identity model not found. Enrollment is required first.")
+        return None
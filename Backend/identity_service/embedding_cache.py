@@ -0,0 +1,73 @@
+import hashlib
+import os
+import numpy as np
+from common.model_runtime import YOLO_RUNTIME, FACENET_RUNTIME
+
+CACHE_PATH = "data/embedding_cache.npz"
+# Bump (or set via env) whenever the detector or FaceNet weights change: a new version invalidates the cache.
+# The runtimes are part of it, so switching e.g. FACENET_RUNTIME=int8 never mixes eager and int8 embeddings.
+EMBED_MODEL_VERSION = os.getenv("EMBED_MODEL_VERSION",
+                                f"yolo-best.pt:{YOLO_RUNTIME}+facenet-vggface2:{FACENET_RUNTIME}/v1")
+EMBEDDING_DIM = 512
+
+
+class EmbeddingCache:
+    """
+    Persistent FaceNet embeddings keyed by the SHA-1 of the image bytes, so /train only embeds
+    new or changed photos. Images where no face was found are cached too (as "no face"),
+    so they are not re-detected on every run either.
+    """
+
+    def __init__(self, path=CACHE_PATH, version=EMBED_MODEL_VERSION):
+        self.path = path
+        self.version = version
+        self.entries = {}  # sha1 hex -> float32[512] embedding, or None when no face was found
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def key(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        data = np.load(self.path)
+        if str(data["version"]) != self.version:
+            print(f"♻️ Embedding cache built with {data['version']}, rebuilding for {self.version}")
+            return
+        for key, emb, has_face in zip(data["keys"], data["embeddings"], data["has_face"]):
+            self.entries[str(key)] = emb if has_face else None
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        self.hits += 1
+        return self.entries[key]
+
+    def put(self, key, embedding):
+        self.misses += 1
+        self.entries[key] = None if embedding is None else np.asarray(embedding, dtype=np.float32)
+
+    def prune(self, keep):
+        """Drops entries whose image no longer exists on disk. Returns how many were removed."""
+        stale = [key for key in self.entries if key not in keep]
+        for key in stale:
+            del self.entries[key]
+        return len(stale)
+
+    def save(self):
+        keys = list(self.entries)
+        embeddings = np.zeros((len(keys), EMBEDDING_DIM), dtype=np.float32)
+        has_face = np.zeros(len(keys), dtype=bool)
+        for i, key in enumerate(keys):
+            if self.entries[key] is not None:
+                embeddings[i] = self.entries[key]
+                has_face[i] = True
+        # Write next to the real file and swap it in, so a crash never leaves a half-written cache
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, version=self.version, keys=np.array(keys, dtype="U40"),
+                 embeddings=embeddings, has_face=has_face)
+        os.replace(tmp_path, self.path)
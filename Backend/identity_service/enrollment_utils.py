@@ -25,15 +25,17 @@
 
 
 import os
+import time
 import cv2 as cv
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import torch
 import pickle
 from sklearn.preprocessing import LabelEncoder
 from sklearn.svm import SVC
-from facenet_pytorch import InceptionResnetV1
-from ultralytics import YOLO
+from model_registry import registry as shared_models
+from classifiers import IDENTITY_BACKEND
+from embedding_cache import EmbeddingCache
 
 # --- CONFIGURATION ---
 DATA_DIR = "data/students_faces"
@@ -41,70 +43,235 @@ SVM_MODEL_PATH = "data/svm_model_facenet.pkl"
 ENCODER_PATH = "data/label_encoder.pkl"
 EMBEDDINGS_PATH = "data/faces_embeddings_facenet.npz"
 
+# Enrollment pipeline knobs (can also come from environment variables)
+ENROLL_BATCH_SIZE = int(os.getenv("ENROLL_BATCH_SIZE", "16"))   # images per YOLO/FaceNet pass
+ENROLL_IO_WORKERS = int(os.getenv("ENROLL_IO_WORKERS", "4"))    # threads reading/decoding images
+
+# /enroll quality gate: images failing it are rejected right away instead of being stored and
+# silently dropped by sync_and_train later
+ENROLL_MIN_FACE = int(os.getenv("ENROLL_MIN_FACE", "80"))       # px, shorter side of the face box
+ENROLL_MIN_SHARPNESS = float(os.getenv("ENROLL_MIN_SHARPNESS", "50"))  # variance of the Laplacian on the face
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
 # DATA_DIR = BASE_DIR/"data/students_faces"
 # SVM_MODEL_PATH = BASE_DIR/"data/svm_model_facenet.pkl"
 # ENCODER_PATH = BASE_DIR/"data/label_encoder.pkl"
 # EMBEDDINGS_PATH = BASE_DIR/"data/faces_embeddings_facenet.npz"
 
+def hash_file(path):
+    with open(path, "rb") as f:
+        return EmbeddingCache.key(f.read())
+
+
+def store_image(student_dir, data, ext):
+    """
+    Writes the uploaded bytes as they came (no decode/re-encode) under their content hash.
+    O_EXCL makes concurrent uploads race-free; the same photo sent twice is stored once.
+    Returns (file name, whether it was new).
+    """
+    name = EmbeddingCache.key(data) + ext
+    try:
+        fd = os.open(os.path.join(student_dir, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+    except FileExistsError:
+        return name, False
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return name, True
+
+
+def sharpness(gray):
+    """Variance of the Laplacian: low on blurred / out-of-focus images."""
+    return float(cv.Laplacian(gray, cv.CV_64F).var())
+
+
 class EnrollmentManager:
-    def __init__(self):
+    def __init__(self, models=shared_models):
         self.DATA_DIR = "data/students_faces"
         # self.DATA_DIR = BASE_DIR/"data/students_faces"
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # Same YOLO / FaceNet instances as the identity workers (loaded on first use, never twice)
+        self.models = models
+        self.device = models.device
         print(f"Initializing Enrollment Manager on {self.device}...")
-        
-        # Load model
-        self.detector = YOLO("/app/weights/best.pt") # will be replaced with face-specific YOLO for better results
         # self.detector = YOLO(model_path)
-        self.facenet = InceptionResnetV1(pretrained="vggface2").eval().to(self.device)
+        self._face_cls = None
+
+    def face_cls(self):
+        if self._face_cls is None:
+            names = self.models.detector().names
+            self._face_cls = next(k for k, v in names.items() if v.lower() == "face")
+        return self._face_cls
+
+    def detect_faces(self, imgs):
+        """One YOLO pass -> the face boxes ([x1, y1, x2, y2] ints) found in each BGR image."""
+        face_cls = self.face_cls()
+        return [[b.xyxy[0].cpu().numpy().astype(int).tolist() for b in result.boxes if int(b.cls[0]) == face_cls]
+                for result in self.models.detect(imgs)]
+
+    def check_image(self, img, face_boxes):
+        """Enrollment quality gate for one image -> None when usable, else the rejection reason."""
+        if img is None:
+            return "not a readable image"
+        if not face_boxes:
+            return "no face found"
+        if len(face_boxes) > 1:
+            return "more than one face"
+        x1, y1, x2, y2 = (max(v, 0) for v in face_boxes[0])
+        if min(x2 - x1, y2 - y1) < ENROLL_MIN_FACE:
+            return f"face too small ({min(x2 - x1, y2 - y1)}px, need {ENROLL_MIN_FACE}px)"
+        score = sharpness(cv.cvtColor(img[y1:y2, x1:x2], cv.COLOR_BGR2GRAY))
+        if score < ENROLL_MIN_SHARPNESS:
+            return f"too blurry (sharpness {score:.0f}, need {ENROLL_MIN_SHARPNESS:.0f})"
+        return None
+
+    def ingest(self, student_name, uploads, workers=ENROLL_IO_WORKERS):
+        """
+        /enroll: uploads are [(file name, binary file object)]. Reading, decoding, quality checks
+        and writes run on `workers` threads, detection is one batched pass on the shared YOLO.
+        Only accepted images are stored, as their original bytes. Returns one verdict per upload.
+        """
+        student_dir = os.path.join(DATA_DIR, student_name)
+        os.makedirs(student_dir, exist_ok=True)
+
+        def decode(data):
+            return cv.imdecode(np.frombuffer(data, np.uint8), cv.IMREAD_COLOR)
+
+        def finish(filename, data, img, face_boxes):
+            reason = self.check_image(img, face_boxes)
+            if reason is not None:
+                return {"file": filename, "accepted": False, "reason": reason}
+            ext = os.path.splitext(filename or "")[1].lower()
+            stored, new = store_image(student_dir, data, ext if ext in IMAGE_EXTS else ".jpg")
+            return {"file": filename, "accepted": True, "stored_as": stored, "duplicate": not new}
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enroll-ingest") as pool:
+            names = [filename for filename, _ in uploads]
+            datas = list(pool.map(lambda upload: upload[1].read(), uploads))
+            imgs = list(pool.map(decode, datas))
+            decoded = [i for i, img in enumerate(imgs) if img is not None]
+            face_boxes = [[] for _ in uploads]
+            for start in range(0, len(decoded), ENROLL_BATCH_SIZE):
+                chunk = decoded[start:start + ENROLL_BATCH_SIZE]
+                for i, boxes in zip(chunk, self.detect_faces([imgs[i] for i in chunk])):
+                    face_boxes[i] = boxes
+            return list(pool.map(finish, names, datas, imgs, face_boxes))
+
+    def embed(self, img):
+        """Detect the face in a BGR image and return its FaceNet embedding (None if no usable face)."""
+        return self.embed_batch([img])[0]
+
+    def embed_batch(self, imgs):
+        """One YOLO pass and one FaceNet pass for a list of BGR images -> embedding or None per image."""
+        # Detect face (face-class boxes only, the same ones the ingest gate checked; the most
+        # confident first). One pass, writes nothing, no runs/ to clean up
+        face_boxes = self.detect_faces(imgs)
+
+        faces, face_idx = [], []
+        for i, (img, boxes) in enumerate(zip(imgs, face_boxes)):
+            if not boxes: continue
+
+            x1, y1, x2, y2 = (max(v, 0) for v in boxes[0])
+            crop = img[y1:y2, x1:x2]
+
+            if crop.size == 0: continue
 
-    def sync_and_train(self):
-        """Step 2 & 3: Generate embeddings for all folders and train the SVM."""
+            # Facenet Preprocessing
+            face = cv.cvtColor(crop, cv.COLOR_BGR2RGB)
+            faces.append(cv.resize(face, (160, 160)))
+            face_idx.append(i)
+
+        embeddings = [None] * len(imgs)
+        if not faces:
+            return embeddings
+
+        batch = np.stack(faces).astype(np.float32) / 255.0
+        batch = torch.from_numpy(np.transpose(batch, (0, 3, 1, 2))).to(self.device)
+        for i, embedding in zip(face_idx, self.models.embed(batch)):
+            embeddings[i] = embedding
+        return embeddings
+
+    def embed_files(self, paths, batch_size=ENROLL_BATCH_SIZE, workers=ENROLL_IO_WORKERS):
+        """
+        Streaming pipeline: image files are decoded by `workers` threads while the previous batch
+        is on YOLO/FaceNet. Yields (path, embedding or None) and reports progress and images/s.
+        Files that cannot be decoded are skipped.
+        """
+        batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        done, start = 0, time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enroll-io") as pool:
+            def prefetch(batch):
+                return [pool.submit(cv.imread, path) for path in batch]
+
+            upcoming = prefetch(batches[0]) if batches else []
+            for i, batch in enumerate(batches):
+                current = upcoming
+                # Start reading the next batch before running inference on this one
+                if i + 1 < len(batches):
+                    upcoming = prefetch(batches[i + 1])
+
+                decoded = [(path, f.result()) for path, f in zip(batch, current)]
+                decoded = [(path, img) for path, img in decoded if img is not None]
+                if decoded:
+                    embeddings = self.embed_batch([img for _, img in decoded])
+                    for (path, _), embedding in zip(decoded, embeddings):
+                        yield path, embedding
+
+                done += len(batch)
+                elapsed = time.perf_counter() - start
+                print(f"⏳ Embedded {done}/{len(paths)} images ({done / max(elapsed, 1e-9):.1f} img/s)")
+
+    def sync_and_train(self, batch_size=ENROLL_BATCH_SIZE, workers=ENROLL_IO_WORKERS):
+        """
+        Step 2 & 3: Generate embeddings for new/changed images (cached by content hash) and train the SVM.
+        Raises RuntimeError when no face was found in any image (nothing is trained or saved).
+        """
         X_all, Y_all = [], []
+        cache = EmbeddingCache()
 
-        print("🔄 Generating embeddings for all registered students...")
-        
+        print("🔄 Syncing embeddings for all registered students...")
+
+        files = []  # (student_name, img_path)
         for student_name in os.listdir(DATA_DIR):
             student_dir = os.path.join(DATA_DIR, student_name)
             if not os.path.isdir(student_dir): continue
 
             for img_name in os.listdir(student_dir):
-                img_path = os.path.join(student_dir, img_name)
-                img = cv.imread(img_path)
-                if img is None: continue
-
-                # Detect face
-                results = self.detector(img, verbose=False, save=False, save_txt=False,
-    save_conf=False, project=None)
-                
-                # 🔥 cleanup YOLO junk
-                runs_path = Path.cwd() / "runs"
-                if runs_path.exists():
-                    import shutil
-                    shutil.rmtree(runs_path)
-                    print("runs/ deleted")
-
-
-                if len(results[0].boxes) > 0:
-                    box = results[0].boxes[0]
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
-                    crop = img[y1:y2, x1:x2]
-
-                    if crop.size == 0: continue
-
-                    # Facenet Preprocessing
-                    face = cv.cvtColor(crop, cv.COLOR_BGR2RGB)
-                    face = cv.resize(face, (160, 160))
-                    face = face.astype(np.float32) / 255.0
-                    face = torch.from_numpy(np.transpose(face, (2, 0, 1))).unsqueeze(0).to(self.device)
-
-                    with torch.no_grad():
-                        embedding = self.facenet(face).cpu().numpy().flatten()
-                        X_all.append(embedding)
-                        Y_all.append(student_name)
+                files.append((student_name, os.path.join(student_dir, img_name)))
+
+        # Content hashes, read in parallel
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enroll-hash") as pool:
+            keys = list(pool.map(hash_file, [path for _, path in files]))
+
+        # Only new or changed images go through the models
+        key_of = dict(zip((path for _, path in files), keys))
+        missing = list({key_of[path]: path for _, path in files if key_of[path] not in cache}.values())
+        for path, embedding in self.embed_files(missing, batch_size, workers):
+            cache.put(key_of[path], embedding)
+
+        for (student_name, _), key in zip(files, keys):
+            if key not in cache: continue  # undecodable file
+            embedding = cache.get(key)
+            if embedding is not None:
+                X_all.append(embedding)
+                Y_all.append(student_name)
+
+        pruned = cache.prune(set(keys))
+        cache.save()
+        print(f"🗂️ Embeddings: {cache.misses} computed, {len(files) - len(missing)} from cache, {pruned} pruned")
 
         if len(X_all) == 0:
+            # Raise, don't return: the training job must fail instead of swapping in the old classifier
             print("❌ No faces found in data directory. Training aborted.")
+            raise RuntimeError("No faces found in the enrolled images, nothing was trained")
+
+        # Save everything
+        # os.makedirs(Path(__file__).resolve().parent/"data", exist_ok=True)  This line is not needed because data/ already exists
+        # The embeddings file is all the gallery backends need
+        np.savez(EMBEDDINGS_PATH, X=X_all, Y=Y_all)
+
+        if IDENTITY_BACKEND != "svm":
+            print(f"📚 Gallery updated with {len(np.unique(Y_all))} identities (backend={IDENTITY_BACKEND}), SVM skipped.")
             return
 
         # --- Train SVM ---
@@ -117,11 +284,8 @@ class EnrollmentManager:
         svm_model = SVC(kernel="linear", probability=True)
         svm_model.fit(X_all, Y_encoded)
 
-        # Save everything
-        # os.makedirs(Path(__file__).resolve().parent/"data", exist_ok=True)  This line is not needed because data/ already exists
         pickle.dump(svm_model, open(SVM_MODEL_PATH, "wb"))
         pickle.dump(encoder, open(ENCODER_PATH, "wb"))
-        np.savez(EMBEDDINGS_PATH, X=X_all, Y=Y_all)
         
         print("Registration Complete. Models saved to data/")
 
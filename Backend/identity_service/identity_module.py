@@ -9,119 +9,249 @@
 # model_path = BASE_DIR.parent / "vision_service" / "weights" / "best.pt"
 # #-----------------------------------------------------
 
+import os
 import torch
 import cv2 as cv
 import numpy as np
-import pickle
-from collections import Counter, deque
-from facenet_pytorch import InceptionResnetV1
-from ultralytics import YOLO
-from pathlib import Path
+from model_registry import registry as shared_models
+from common.session_store import SessionStore, RingBuffer, DEFAULT_SESSION
+from classifiers import load_classifier
+from common.metrics import metrics
+from common.boxes import box_iou, box_area
 
-# Path Definitions
-
-SVM_MODEL_PATH = "data/svm_model_facenet.pkl"
-ENCODER_PATH = "data/label_encoder.pkl"
+# Path Definitions (classifier files live in classifiers.py)
 # SVM_MODEL_PATH = BASE_DIR/"data/svm_model_facenet.pkl"
 # ENCODER_PATH = BASE_DIR/"data/label_encoder.pkl"
 
-class IdentityProcessor:
+WINDOW_SIZE = 30  # frames per session history
+
+# Face tracking: a confirmed identity is carried forward while its face box keeps overlapping
+# (IoU) and keeps its size; FaceNet + classifier run again on a track break, a sharp size change
+# or at least every IDENTITY_VERIFY_PERIOD frames
+IDENTITY_TRACK_IOU = float(os.getenv("IDENTITY_TRACK_IOU", "0.5"))
+IDENTITY_TRACK_SIZE_CHANGE = float(os.getenv("IDENTITY_TRACK_SIZE_CHANGE", "0.3"))  # max relative area change
+IDENTITY_VERIFY_PERIOD = int(os.getenv("IDENTITY_VERIFY_PERIOD", "15"))
+
+# History codes: identities are stored as small ints, negatives are the two non-identities
+MISSING_CODE = -1
+UNKNOWN_CODE = -2
+# Module-level so codes stay stable across retrains/reloads (a new encoder never looks like an identity switch)
+_label_codes = {"missing": MISSING_CODE, "unknown": UNKNOWN_CODE}
+
+
+def label_code(label):
+    return _label_codes.setdefault(label, len(_label_codes) - 2)
+
+class FaceTrack:
+    """The face box a session's identity was last verified on, and the identity it was verified as."""
+
     def __init__(self):
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        # Load FaceNet once
-        self.facenet = InceptionResnetV1(pretrained="vggface2").eval().to(self.device)
-        # Load YOLO Face detector
-        self.detector = YOLO("/app/weights/best.pt") # will be replaced with face-specific YOLO for better results
+        self.box = None
+        self.label = None
+        self.age = 0  # frames carried since the last verification
+
+    def reset(self):
+        self.box, self.label, self.age = None, None, 0
+
+    def due(self):
+        """The carried identity has to go through FaceNet again on this frame."""
+        return self.label is not None and self.age >= IDENTITY_VERIFY_PERIOD
+
+    def tick(self):
+        """A frame answered without looking at the face (frame gate) still ages the track."""
+        if self.label is not None:
+            self.age += 1
+
+
+class IdentityProcessor:
+    def __init__(self, sessions=None, tracks=None, models=shared_models):
+        # YOLO and FaceNet come from the process-wide registry: every worker (and enrollment) shares one copy
+        self.models = models
+        self.device = models.device
+        self.facenet = models.facenet()
+        self.detector = models.detector()
         # self.detector = YOLO(model_path)
 
         # auto-resolve class IDs from model metadata
-        names = self.detector.model.names
+        names = self.detector.names
         self.FACE_CLS = next(
             k for k, v in names.items() if v.lower() == "face"
         )
         
-        # Load trained SVM
-        try:
-            self.model = pickle.load(open(SVM_MODEL_PATH, "rb"))
-            self.encoder = pickle.load(open(ENCODER_PATH, "rb"))
-        except FileNotFoundError:
-            print("CRITICAL: SVM models not found. Enrollment is required first.")
-            self.model = None
-            
-        self.history = deque(maxlen=30) 
-
-    def process_frame(self, frame, return_visuals=False):
-        # 1. Detect faces
-        results = self.detector(frame, verbose=False, save=False, save_txt=False,
-    save_conf=False, project=None)
-        # 🔥 cleanup YOLO junk
-        runs_path = Path.cwd() / "runs"
-        if runs_path.exists():
-            import shutil
-            shutil.rmtree(runs_path)
-            print("runs/ deleted")
-
-        current_id = "missing" # Default if no box is found
-        debug_frame = frame.copy() if return_visuals else None
-
-        target_box = None
-
-        # Check if boxes exist
-        boxes = results[0].boxes
-        if len(boxes) > 0:
-            current_id = "unknown" # Someone is there, but we haven't identified them yet
-            
-            # Assuming the largest box is the student
+        # Load trained classifier (SVM or embedding gallery, see IDENTITY_BACKEND)
+        self.classifier = load_classifier()
             
+        # Per-session window of the last 30 identity codes
+        self.window_size = WINDOW_SIZE
+        self.sessions = sessions if sessions is not None else SessionStore(lambda: RingBuffer(self.window_size, 1, np.int32))
+        # Per-session face tracks (shared by all workers, like the histories)
+        self.tracks = tracks if tracks is not None else SessionStore(FaceTrack)
+        self.verified = 0  # frames that went through FaceNet + classifier
+        self.carried = 0   # frames that reused a tracked identity
+
+    def detect(self, frame):
+        """Runs the YOLO detector. Returns (face_box, num_boxes); face_box is [x1, y1, x2, y2] or None."""
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        """One YOLO forward pass over several frames -> [(face_box, num_boxes)]."""
+        with metrics.timer("yolo_forward"):
+            results = self.models.detect(frames)  # writes nothing, no runs/ to clean up
+
+        detections = []
+        for result in results:
+            boxes = result.boxes
+            face_box = None
             for b in boxes:
                 if int(b.cls[0]) == self.FACE_CLS:
-                    target_box = b
-                    current_id = "unknown"
+                    face_box = b.xyxy[0].cpu().numpy().astype(int).tolist()
                     break # Take the largest/first face found
-        if target_box is not None:
-            x1, y1, x2, y2 = target_box.xyxy[0].cpu().numpy().astype(int)
-            crop = frame[y1:y2, x1:x2]
-            
-            if crop.size != 0 and crop.shape[0] >= 40 and crop.shape[1] >= 40:
-                # Preprocess for FaceNet
-                face = cv.cvtColor(crop, cv.COLOR_BGR2RGB)
-                face = cv.resize(face, (160, 160))
-                face = face.astype(np.float32) / 255.0
-                face = torch.from_numpy(np.transpose(face, (2, 0, 1))).unsqueeze(0).to(self.device)
-
-                # Inference
-                with torch.no_grad():
-                    emb = self.facenet(face).cpu().numpy()
-                
-                # Predict Identity
-                if self.model:
-                    probs = self.model.predict_proba(emb)
-                    max_prob = np.max(probs)
-                    if max_prob > 0.80: # Threshold for recognition
-                        current_id = self.encoder.inverse_transform([np.argmax(probs)])[0]
-
-            # 2. Draw Visuals if requested (debug)
-            if return_visuals:
+            detections.append((face_box, len(boxes)))
+        return detections
+
+    def crop_face(self, frame, face_box):
+        """160x160 RGB FaceNet input, or None when the face is too small to trust."""
+        x1, y1, x2, y2 = (max(int(v), 0) for v in face_box)
+        crop = frame[y1:y2, x1:x2]
+        if crop.size == 0 or crop.shape[0] < 40 or crop.shape[1] < 40:
+            return None
+        return cv.resize(cv.cvtColor(crop, cv.COLOR_BGR2RGB), (160, 160))
+
+    def identify(self, face):
+        """face: 160x160 RGB uint8 crop. Returns the enrolled name or "unknown"."""
+        return self.identify_batch([face])[0]
+
+    def identify_batch(self, faces):
+        """One FaceNet forward pass + one classifier call (SVM or gallery) for a list of 160x160 RGB crops."""
+        # Preprocess for FaceNet
+        batch = np.stack(faces).astype(np.float32) / 255.0
+        batch = torch.from_numpy(np.transpose(batch, (0, 3, 1, 2))).to(self.device)
+
+        # Inference
+        with metrics.timer("facenet"):
+            emb = self.models.embed(batch)
+
+        # Predict Identity
+        if self.classifier is None:
+            return ["unknown"] * len(faces)
+        with metrics.timer("classifier"):
+            return self.classifier.predict(emb)
+
+    def carry(self, session_id, face_box):
+        """The session's tracked identity if this face box continues the track, else None (verify again)."""
+        track = self.tracks.get(session_id)
+        if face_box is None:
+            track.reset()  # track break: nobody to carry
+            return None
+        if track.label is None or track.age >= IDENTITY_VERIFY_PERIOD:
+            return None
+        old_area, new_area = box_area(track.box), box_area(face_box)
+        if old_area == 0 or abs(new_area - old_area) / old_area > IDENTITY_TRACK_SIZE_CHANGE:
+            return None
+        if box_iou(track.box, face_box) < IDENTITY_TRACK_IOU:
+            return None
+        track.box = face_box
+        track.age += 1
+        return track.label
+
+    def confirm(self, session_id, face_box, label):
+        """Starts a new track from a verified frame. Only enrolled identities are carried."""
+        track = self.tracks.get(session_id)
+        if label in ("unknown", "missing"):
+            track.reset()
+        else:
+            track.box, track.label, track.age = face_box, label, 0
+
+    def label_batch(self, items):
+        """
+        items: [(frame, detection, face, session_id)] from concurrent requests, where
+          - face is a pre-cropped 160x160 RGB face (frame/detection unused), or
+          - detection is (face_box, num_boxes) from vision_service, or
+          - detection is None -> batched self-detection on frame.
+        Returns the current identity label for each item. Faces that continue a session's
+        track reuse its identity instead of going through FaceNet.
+        """
+        detections = [det for _, det, _, _ in items]
+        pending = [i for i, (_, det, face, _) in enumerate(items) if face is None and det is None]
+        if pending:
+            for i, det in zip(pending, self.detect_batch([items[i][0] for i in pending])):
+                detections[i] = det
+
+        labels, faces, face_idx, carried_idx = [], [], [], set()
+        for i, (frame, _, face, session_id) in enumerate(items):
+            if face is None:
+                face_box, num_boxes = detections[i]
+                # "missing" if no box at all, "unknown" until someone is identified
+                labels.append("unknown" if num_boxes > 0 or face_box is not None else "missing")
+                carried = self.carry(session_id, face_box)
+                if carried is not None:
+                    labels[i] = carried
+                    carried_idx.add(i)
+                    self.carried += 1
+                    continue
+                if face_box is not None:
+                    face = self.crop_face(frame, face_box)
+            else:
+                labels.append("unknown")
+            if face is not None:
+                faces.append(face)
+                face_idx.append(i)
+
+        if faces:
+            self.verified += len(faces)
+            for i, label in zip(face_idx, self.identify_batch(faces)):
+                labels[i] = label
+        # Every face that was looked at (re)starts its session's track
+        for i, (_, _, face, session_id) in enumerate(items):
+            if face is None and detections[i][0] is not None and i not in carried_idx:
+                self.confirm(session_id, detections[i][0], labels[i])
+        return labels
+
+    def process_frame(self, frame, session_id=DEFAULT_SESSION, return_visuals=False, detection=None):
+        """
+        detection: optional (face_box, num_boxes) from an upstream detector (vision_service).
+        When it is None the frame goes through our own YOLO pass.
+        """
+        # 1. Detect faces (skipped when vision_service already did it)
+        if detection is None:
+            detection = self.detect(frame)
+        current_id = self.label_batch([(frame, detection, None, session_id)])[0]
+
+        # 2. Draw Visuals if requested (debug)
+        target_box = detection[0]
+        if return_visuals:
+            debug_frame = frame.copy()
+            if target_box is not None:
+                x1, y1, x2, y2 = target_box
                 color = (0, 255, 0) if current_id not in ["unknown", "missing"] else (0, 0, 255)
                 cv.rectangle(debug_frame, (x1, y1), (x2, y2), color, 2)
                 cv.putText(debug_frame, f"ID: {current_id}", (x1, y1 - 10), 
                            cv.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
+        ratios = self.update(session_id, current_id)
+
+        if return_visuals:
+            return ratios, debug_frame
+        return ratios
+
+    def process_face(self, face, session_id=DEFAULT_SESSION):
+        """Entry point for a pre-cropped 160x160 RGB face (no decode, no detection)."""
+        return self.update(session_id, self.identify(face))
+
+    def update(self, session_id, current_id):
         # 3. Update Temporal History
-        self.history.append(current_id)
-        counts = Counter(self.history)
-        total = len(self.history)
+        history = self.sessions.get(session_id)
+        history.append(label_code(current_id))
+        codes = history.values()[:, 0]
+        total = len(codes)
 
         # 4. Calculate Features for Fusion
         # dom_ratio: how often the "main" student is present
         # switch_ratio: how often the person in front of the cam changes
         # unknown_ratio: combined "no face" and "wrong face" risk
-        ratios = [
-            counts.most_common(1)[0][1] / total,
-            sum(self.history[i] != self.history[i-1] for i in range(1, total)) / total if total > 1 else 0,
-            (counts.get("unknown", 0) + counts.get("missing", 0)) / total
+        _, counts = np.unique(codes, return_counts=True)
+        return [
+            float(counts.max()) / total,
+            float(np.count_nonzero(codes[1:] != codes[:-1])) / total if total > 1 else 0,
+            float(np.count_nonzero(codes < 0)) / total
         ]
-
-        if return_visuals:
-            return ratios, debug_frame
-        return ratios
\ No newline at end of file
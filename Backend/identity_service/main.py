@@ -1,13 +1,26 @@
+import asyncio
+import threading
 import cv2
+import json
 import numpy as np
 import os
-from fastapi import FastAPI, UploadFile, File, Form
-from identity_module import IdentityProcessor
+from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException
+from fastapi.responses import JSONResponse
+from identity_module import IdentityProcessor, FaceTrack, WINDOW_SIZE
+from classifiers import load_classifier
+from training_jobs import TrainingJobs
 from enrollment_utils import EnrollmentManager
 from enrollment_utils import DATA_DIR
+from model_registry import registry
+from common.session_store import SessionStore, RingBuffer, DEFAULT_SESSION
+from common.frame_gate import FrameGate
+from common.metrics import metrics, instrument
+from common.batching import MicroBatcher
+from common.workers import ModelPool, QueueFull
 from fastapi.middleware.cors import CORSMiddleware
 
 app = FastAPI()
+instrument(app)  # /metrics
 
 app.add_middleware(
     CORSMiddleware,
@@ -17,42 +30,120 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variable to hold the processor (reloaded after enrollment)
-identity_p = IdentityProcessor()
+# Workers for YOLO + FaceNet + SVM. Each worker owns its own IdentityProcessor (classifier, counters),
+# but all of them share the registry's single YOLO and FaceNet: YOLO passes run one at a time behind
+# the registry's lock, FaceNet and the classifier overlap. More than one worker only pays off when
+# FaceNet/classifier time dominates (shared-detection mode, where identity rarely runs YOLO itself).
+IDENTITY_WORKERS = int(os.getenv("IDENTITY_WORKERS", "1"))
+
+# Session histories live outside the workers so every worker shares them
+sessions = SessionStore(lambda: RingBuffer(WINDOW_SIZE, 1, np.int32))
+tracks = SessionStore(FaceTrack)
+
+# Processors are built once; after training only their classifier is swapped in
+identity_pool = ModelPool(lambda: IdentityProcessor(sessions, tracks), workers=IDENTITY_WORKERS, name="identity")
+identity_p = identity_pool.instances[0]  # for the cheap, model-free history update
+
+# Training is slow and runs one job at a time, away from the event loop and the inference workers
+training_jobs = TrainingJobs()
+enrollment_manager = EnrollmentManager()  # borrows the registry's models, nothing new is loaded
+
+FACE_CROP_BYTES = 160 * 160 * 3  # pre-cropped RGB face forwarded by the pipeline
+
+# Near-identical consecutive frames of a session reuse the last identity label (no YOLO/FaceNet/classifier)
+frame_gate = FrameGate()
+
+
+def label_batch(identity, items):
+    return identity.label_batch(items)
+
+
+# Frames/crops from concurrent requests share one YOLO pass and one FaceNet pass
+batcher = MicroBatcher(label_batch, identity_pool)
+
+# Queue depths and in-flight work, read on every /metrics scrape
+metrics.gauge("identity_batch_pending", lambda: batcher.stats()["pending"])
+metrics.gauge("identity_in_flight", lambda: identity_pool.in_flight)
+metrics.gauge("rejected", lambda: identity_pool.rejected)
+metrics.gauge("sessions", lambda: len(sessions))
+
+
+@app.on_event("startup")
+def warm_models():
+    """Dummy inference through YOLO + FaceNet in the background; /health says "warming" until it's done."""
+    threading.Thread(target=registry.warmup, daemon=True, name="identity-warmup").start()
+
+
+@app.get("/health")
+async def health():
+    """
+    200 once the models are loaded and warm, 503 before (compose healthcheck / gateway readiness).
+    A failed warmup stays 503 with status "failed" and the error under models.error.
+    """
+    status = "ready" if registry.ready else "failed" if registry.error else "warming"
+    body = {"status": status, "models": registry.stats(),
+            "classifier_loaded": identity_p.classifier is not None}
+    return JSONResponse(status_code=200 if registry.ready else 503, content=body)
+
+
+@app.exception_handler(QueueFull)
+async def queue_full_handler(request: Request, exc: QueueFull):
+    return JSONResponse(status_code=503, content={"status": "queue_full", "message": str(exc)})
+
+
+def train_and_swap():
+    """Training job: sync embeddings, retrain, then hot-swap the classifier into every worker."""
+    enrollment_manager.sync_and_train()
+
+    classifier = load_classifier()
+    if classifier is None:
+        raise RuntimeError("Training produced no classifier (no faces enrolled?)")
+    # A single attribute assignment per worker: in-flight batches finish with the old
+    # classifier, the next batch uses the new one. FaceNet/YOLO stay loaded.
+    for processor in identity_pool.instances:
+        processor.classifier = classifier
+    return "Identity model updated and swapped in"
 
 
 #---------------------------------------------------------------------------------
 @app.post("/enroll")
 async def enroll_student(student_name: str = Form(...), files: list[UploadFile] = File(...)):
-    manager = EnrollmentManager()
-    student_dir = os.path.join(manager.DATA_DIR, student_name)
-    os.makedirs(student_dir, exist_ok=True)
+    """
+    Stores the uploads that pass the quality gate (one face, big enough, sharp enough) and
+    returns accept/reject per image right away, so the client can retake the rejected ones.
+    """
+    if not student_name or os.path.basename(student_name) != student_name or student_name.startswith("."):
+        raise HTTPException(status_code=400, detail="Invalid student name")
 
-    # Count existing files to avoid overwriting during multiple requests
-    existing_count = len(os.listdir(student_dir))
+    # The uploads are already spooled by the multipart parser; they're read, checked and written
+    # on worker threads (YOLO shared with the identity workers), never on the event loop
+    uploads = [(file.filename, file.file) for file in files]
+    results = await asyncio.get_running_loop().run_in_executor(
+        None, enrollment_manager.ingest, student_name, uploads)
 
-    for idx, file in enumerate(files):
-        contents = await file.read()
-        nparr = np.frombuffer(contents, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if frame is not None:
-            # Save frame without training
-            file_path = os.path.join(student_dir, f"{existing_count + idx}.jpg")
-            cv2.imwrite(file_path, frame)
+    accepted = sum(r["accepted"] for r in results)
+    return {
+        "status": "success" if accepted else "rejected",
+        "message": f"Accepted {accepted} of {len(files)} images for {student_name}",
+        "accepted": accepted,
+        "rejected": len(files) - accepted,
+        "images": results,
+    }
 
-    return {"status": "success", "message": f"Saved {len(files)} images for {student_name}"}
-
-@app.post("/train")
+@app.post("/train", status_code=202)
 async def train_model():
-    print("🚀 Training request received. Starting SVM sync_and_train...")
-    manager = EnrollmentManager()
-    
-    manager.sync_and_train()
-    
-    global identity_p
-    identity_p = IdentityProcessor() # Reload weights
-    
-    return {"status": "success", "message": "SVM Model updated and reloaded"}
+    print("🚀 Training request received. Queuing sync_and_train...")
+    job_id = training_jobs.submit(train_and_swap)
+    return {"status": "accepted", "job_id": job_id, "message": "Training queued, poll /train/{job_id}"}
+
+
+@app.get("/train/{job_id}")
+async def train_status(job_id: str):
+    """queued -> running -> succeeded | failed"""
+    job = training_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown training job")
+    return job
 #---------------------------------------------------------------------------------
 
 
@@ -81,19 +172,96 @@ async def train_model():
 
 
 @app.post("/process")
-async def verify_identity(file: UploadFile = File(...)):
-    """Predicts identity and returns [dom_ratio, switch_ratio, unknown_ratio]."""
-    contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+async def verify_identity(
+    file: UploadFile = File(None),
+    session_id: str = Form(DEFAULT_SESSION),
+    face_box: str = Form(None),
+    num_boxes: int = Form(0),
+    face: UploadFile = File(None),
+):
+    """
+    Predicts identity and returns [dom_ratio, switch_ratio, unknown_ratio].
+
+    Shared-detection mode (vision_service already ran YOLO on this frame):
+      - face_box: JSON "[x1, y1, x2, y2]" or "null", plus num_boxes -> identity skips its own YOLO pass
+      - face: raw 160x160x3 RGB uint8 crop -> no decode and no detection at all
+    Without either, identity falls back to self-detection on `file`.
+    """
+    if face is not None:
+        return await identify_crop(await face.read(), session_id)
+    if file is None:
+        return [0.0, 0.0, 1.0]
+    return await identify_frame(await file.read(), session_id, face_box, num_boxes)
+
+
+@app.post("/process_raw")
+async def verify_identity_raw(
+    request: Request,
+    session_id: str = DEFAULT_SESSION,
+    face_box: str = None,
+    num_boxes: int = 0,
+    crop: bool = False,
+):
+    """Same as /process with the raw body (JPEG, or the 160x160 RGB crop when crop=true). Used by the gateway."""
+    contents = await request.body()
+    if crop:
+        return await identify_crop(contents, session_id)
+    return await identify_frame(contents, session_id, face_box, num_boxes)
+
+
+async def identify_crop(face_bytes, session_id):
+    if len(face_bytes) != FACE_CROP_BYTES:
+        return [0.0, 0.0, 1.0]
+    crop = np.frombuffer(face_bytes, np.uint8).reshape(160, 160, 3)
+    current_id = await gated_label(session_id, crop, (None, None, crop, session_id))
+    return identity_p.update(session_id, current_id)
+
+
+async def identify_frame(contents, session_id, face_box, num_boxes):
+    with metrics.timer("decode"):
+        nparr = np.frombuffer(contents, np.uint8)
+        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
     if frame is None:
         return [0.0, 0.0, 1.0]
 
+    detection = (json.loads(face_box), num_boxes) if face_box is not None else None
+
+    current_id = await gated_label(session_id, frame, (frame, detection, None, session_id))
+
     # Returns the 3 ratios expected by the Gateway
-    ratios = identity_p.process_frame(frame)
+    ratios = identity_p.update(session_id, current_id)
     return ratios
 
+
+async def gated_label(session_id, image, item):
+    """Current identity label: reused when the image barely changed since the last full pass, else batched."""
+    # Every frame the session sends ages its face track, gated or not, and a track due for
+    # re-verification bypasses the gate: FaceNet runs every IDENTITY_VERIFY_PERIOD frames
+    track = tracks.get(session_id)
+    cached, thumb = frame_gate.check(session_id, image, force=track.due())
+    if cached is not None:
+        track.tick()
+        return cached
+    # (includes queueing; yolo_forward / facenet / classifier are the pure compute)
+    with metrics.timer("identify"):
+        current_id = await batcher.submit(item)
+    frame_gate.store(session_id, thumb, current_id)
+    return current_id
+
+
+@app.get("/batch_stats")
+async def batch_stats():
+    """Achieved micro-batch sizes (BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS tune them) and pool load."""
+    return {
+        **batcher.stats(),
+        "identity_pool": identity_pool.stats(),
+        "frame_gate": frame_gate.stats(),
+        # FaceNet + classifier runs vs frames that carried a tracked identity forward
+        "verified_frames": sum(p.verified for p in identity_pool.instances),
+        "carried_frames": sum(p.carried for p in identity_pool.instances),
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8002)
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""
+One copy of each identity model per process.
+
+YOLO and FaceNet are loaded on first use and then handed out to every IdentityProcessor worker,
+the EnrollmentManager and training jobs, instead of each of them loading its own. warmup() runs
+one dummy inference through both so the first real request doesn't pay lazy initialization
+(CUDA context, cuDNN autotuning, ultralytics predictor setup); `ready` only turns true after it,
+and /health reports it (or the error, when a model failed to load).
+"""
+import threading
+import time
+import numpy as np
+import torch
+from common.model_runtime import load_yolo, load_facenet, FACE_SIZE, YOLO_PREDICT_ARGS
+
+YOLO_WEIGHTS = "/app/weights/best.pt"  # will be replaced with face-specific YOLO for better results
+WARMUP_FRAME = (480, 640, 3)           # a typical webcam frame
+
+
+class ModelRegistry:
+    def __init__(self, weights=YOLO_WEIGHTS):
+        self.weights = weights
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self._detector = None
+        self._facenet = None
+        self._load_lock = threading.Lock()
+        # An ultralytics model keeps per-call predictor state, so YOLO passes are serialized.
+        # FaceNet is a plain eval-mode module and is safe to share between threads under no_grad.
+        self.detector_lock = threading.Lock()
+        self.ready = False
+        self.warmup_ms = None
+        self.error = None  # why warmup failed, if it did
+
+    def detector(self):
+        if self._detector is None:
+            with self._load_lock:
+                if self._detector is None:
+                    print(f"📥 Loading YOLO from {self.weights}...")
+                    self._detector = load_yolo(self.weights)  # eager / torchscript / onnx, per YOLO_RUNTIME
+        return self._detector
+
+    def facenet(self):
+        if self._facenet is None:
+            with self._load_lock:
+                if self._facenet is None:
+                    print(f"📥 Loading FaceNet on {self.device}...")
+                    self._facenet = load_facenet(self.device)  # eager / torchscript / int8, per FACENET_RUNTIME
+        return self._facenet
+
+    def detect(self, frames):
+        """One YOLO pass over a list of BGR frames (the shared detector, one caller at a time)."""
+        detector = self.detector()
+        with self.detector_lock:
+            return detector(frames, **YOLO_PREDICT_ARGS)
+
+    def embed(self, faces):
+        """faces: float32 tensor (N, 3, 160, 160) in [0, 1] on self.device -> (N, 512) embeddings."""
+        with torch.no_grad():
+            return self.facenet()(faces).cpu().numpy()
+
+    def warmup(self):
+        """
+        Loads both models and runs one inference through each; marks the registry ready.
+        Runs on a background thread, so a failure is logged and kept in `error` instead of raised.
+        """
+        start = time.perf_counter()
+        try:
+            self.detect([np.zeros(WARMUP_FRAME, dtype=np.uint8)])
+            self.embed(torch.zeros(1, 3, FACE_SIZE, FACE_SIZE, device=self.device))
+        except Exception as e:
+            self.error = repr(e)
+            print(f"❌ Identity model warmup failed: {e!r}")
+            return
+        self.warmup_ms = (time.perf_counter() - start) * 1000
+        self.error = None
+        self.ready = True
+        print(f"🔥 Identity models warm ({self.warmup_ms:.0f} ms)")
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "device": self.device,
+            "detector_loaded": self._detector is not None,
+            "facenet_loaded": self._facenet is not None,
+            "warmup_ms": self.warmup_ms,
+            "error": self.error,
+        }
+
+
+registry = ModelRegistry()
@@ -0,0 +1,83 @@
+"""
+Sustained /process_raw traffic must not touch the disk: no ultralytics runs/ folders, no frame
+dumps, nothing. YOLO and FaceNet are replaced by stand-ins in the shared registry (no weights
+needed); the stand-in YOLO writes a runs/ folder like ultralytics does unless it is called with
+the write-free YOLO_PREDICT_ARGS.
+"""
+import os
+import cv2
+import numpy as np
+import pytest
+import torch
+from fastapi.testclient import TestClient
+from model_registry import registry
+
+SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+FRAMES = 50
+
+
+class FakeBox:
+    def __init__(self, cls, xyxy):
+        self.cls = torch.tensor([float(cls)])
+        self.xyxy = torch.tensor([xyxy], dtype=torch.float32)
+
+
+class FakeResult:
+    def __init__(self):
+        self.boxes = [FakeBox(0, [200, 120, 440, 380])]
+
+
+class FakeYOLO:
+    names = {0: "face", 1: "phone"}
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, frames, **kwargs):
+        self.calls += 1
+        if any(kwargs.get(k) is not False for k in ("save", "save_txt", "save_conf", "save_crop")):
+            os.makedirs(os.path.join("runs", "detect", f"predict{self.calls}"), exist_ok=True)
+        return [FakeResult() for _ in frames]
+
+
+class FakeClassifier:
+    def predict(self, embeddings):
+        return ["alice"] * len(embeddings)
+
+
+def snapshot(root):
+    """Every file and directory under root with its size and mtime (bytecode caches excluded)."""
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in ("__pycache__", ".pytest_cache")]
+        for name in dirnames:
+            tree[os.path.join(dirpath, name) + os.sep] = None
+        for name in filenames:
+            st = os.stat(os.path.join(dirpath, name))
+            tree[os.path.join(dirpath, name)] = (st.st_size, st.st_mtime_ns)
+    return tree
+
+
+@pytest.fixture()
+def service(tmp_path, monkeypatch):
+    registry._detector = FakeYOLO()
+    registry._facenet = lambda faces: torch.zeros(len(faces), 512)
+    import main
+    for processor in main.identity_pool.instances:
+        processor.classifier = FakeClassifier()
+    monkeypatch.chdir(tmp_path)  # anything written relative to the working directory lands here
+    return main
+
+
+def test_process_raw_writes_nothing(service, tmp_path):
+    rng = np.random.default_rng(0)
+    before = snapshot(SERVICE_DIR), snapshot(tmp_path)
+    with TestClient(service.app) as client:
+        for i in range(FRAMES):
+            # A fresh frame each time, so the frame gate doesn't answer from its cache
+            frame = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+            body = cv2.imencode(".jpg", frame)[1].tobytes()
+            res = client.post("/process_raw", params={"session_id": f"s{i % 4}"}, content=body)
+            assert res.status_code == 200
+    assert registry.detector().calls > 0
+    assert (snapshot(SERVICE_DIR), snapshot(tmp_path)) == before
@@ -0,0 +1,50 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TrainingJobs:
+    """
+    Background training queue: jobs run one at a time on a dedicated thread, and their
+    status is kept (last `max_history` jobs) so clients can poll instead of holding a request open.
+    """
+
+    def __init__(self, max_history=50):
+        self.max_history = max_history
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="train")
+        self._jobs = OrderedDict()  # job_id -> status dict
+        self._lock = threading.Lock()
+
+    def submit(self, fn):
+        """Queues fn() and returns its job id. fn's return value becomes the job message."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {"job_id": job_id, "status": "queued", "message": "",
+                                  "submitted_at": time.time(), "started_at": None, "finished_at": None}
+            while len(self._jobs) > self.max_history:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job_id, fn)
+        return job_id
+
+    def _run(self, job_id, fn):
+        self._update(job_id, status="running", started_at=time.time())
+        try:
+            message = fn()
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status="failed", message=str(e), finished_at=time.time())
+        else:
+            self._update(job_id, status="succeeded", message=message or "", finished_at=time.time())
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
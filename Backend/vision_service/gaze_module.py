@@ -1,45 +1,139 @@
+import os
 import cv2
 import numpy as np
 import mediapipe as mp
+from common.session_store import SessionStore, DEFAULT_SESSION
+from common.metrics import metrics
+from common.boxes import box_iou
+from preprocess import PreparedFrame
+
+# Iris refinement only moves eye landmarks; head pose below doesn't need it (set 0 to skip it)
+GAZE_REFINE_LANDMARKS = os.getenv("GAZE_REFINE_LANDMARKS", "1") == "1"
+# A face box that overlaps the last measured one at least this much (IoU) counts as a stable head:
+# the previous landmarks are shifted with the box instead of running FaceMesh again...
+GAZE_STABLE_IOU = float(os.getenv("GAZE_STABLE_IOU", "0.85"))
+# ...but never for more than this many frames in a row
+GAZE_REFRESH_FRAMES = int(os.getenv("GAZE_REFRESH_FRAMES", "5"))
+ROI_MARGIN = 0.25  # FaceMesh wants some context around the YOLO face box
+
+# Nose tip, Chin, Left Eye, Right Eye
+POSE_LANDMARKS = [1, 152, 33, 263]
+# 3D model points
+MODEL_PTS = np.array([(0.0, 0.0, 0.0), (0.0, -330.0, -65.0), (-225.0, 170.0, -135.0), (225.0, 170.0, -135.0)])
+DIST_COEFFS = np.zeros((4, 1))
+
+
+class GazeTrack:
+    """Last FaceMesh measurement of a session: the face box it was taken in and the 2D pose points."""
 
-class GazeProcessor:
     def __init__(self):
+        self.box = None
+        self.image_pts = None
+        self.carried = 0  # frames answered from this measurement since FaceMesh last ran
+
+    def due(self):
+        """FaceMesh has to measure again on this frame."""
+        return self.box is not None and self.carried >= GAZE_REFRESH_FRAMES
+
+    def tick(self):
+        """A frame answered without FaceMesh by the frame gate still counts against the refresh period."""
+        if self.box is not None:
+            self.carried += 1
+
+
+class GazeProcessor:
+    def __init__(self, sessions=None, refine_landmarks=GAZE_REFINE_LANDMARKS):
         self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(refine_landmarks=True)
-        self.YAW_THRESH = 20 # 
-        self.PITCH_THRESH = 15 # 
+        # Static mode: every call gets an unrelated crop (other sessions share this instance),
+        # so MediaPipe's own frame-to-frame tracking would only get in the way
+        self.face_mesh = self.mp_face_mesh.FaceMesh(static_image_mode=True, refine_landmarks=refine_landmarks)
+        self.YAW_THRESH = 20 #
+        self.PITCH_THRESH = 15 #
+        # Per-session tracks live outside the worker so every gaze worker shares them
+        self.sessions = sessions if sessions is not None else SessionStore(GazeTrack)
+        self.cam_matrices = {}  # (w, h) -> camera intrinsics
+        self.mesh_runs = 0
+        self.carried_frames = 0
+
+    def cam_matrix(self, w, h):
+        key = (w, h)
+        if key not in self.cam_matrices:
+            focal_length = w
+            self.cam_matrices[key] = np.array([[focal_length, 0, w/2], [0, focal_length, h/2], [0, 0, 1]], dtype="double")
+        return self.cam_matrices[key]
 
     def process_frame(self, frame):
-        h, w, _ = frame.shape
-        results = self.face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        
-        if not results.multi_face_landmarks:
+        """Whole-frame FaceMesh on a BGR frame, no tracking (for callers without a face box)."""
+        rgb = PreparedFrame(frame).rgb
+        h, w, _ = rgb.shape
+        image_pts = self.landmarks(rgb, (0, 0, w, h))
+        if image_pts is None:
             return [1.0, 1.0] # Face missing = maximum gaze risk
+        return self.pose(image_pts, w, h)
+
+    def process_face(self, frame, face_box, session_id=DEFAULT_SESSION):
+        """
+        Gaze for the face YOLO found at face_box ([x1, y1, x2, y2] or None) in a PreparedFrame.
+        FaceMesh runs only on the box region, and is skipped while the head stays put
+        (the frame's RGB buffer is only built when FaceMesh actually runs).
+        Everything below is in the gaze buffer's pixels (GAZE_INPUT_SIZE).
+        """
+        h, w, _ = frame.gaze_shape
+        face_box = frame.to_gaze(face_box)
+        track = self.sessions.get(session_id)
+        if face_box is None:
+            track.box = track.image_pts = None
+            return [1.0, 1.0] # Face missing = maximum gaze risk
+
+        if (track.box is not None and track.carried < GAZE_REFRESH_FRAMES
+                and box_iou(track.box, face_box) >= GAZE_STABLE_IOU):
+            # Stable head: move the previous landmarks along with the box
+            image_pts = track.image_pts + (np.array(face_box[:2]) - np.array(track.box[:2]))
+            track.carried += 1
+            self.carried_frames += 1
+            return self.pose(image_pts, w, h)
+
+        x1, y1, x2, y2 = face_box
+        mx, my = int((x2 - x1) * ROI_MARGIN), int((y2 - y1) * ROI_MARGIN)
+        roi = (max(0, x1 - mx), max(0, y1 - my), min(w, x2 + mx), min(h, y2 + my))
+        image_pts = self.landmarks(frame.rgb, roi)
+        if image_pts is None:
+            track.box = track.image_pts = None
+            return [1.0, 1.0]
+
+        track.box, track.image_pts, track.carried = list(face_box), image_pts, 0
+        return self.pose(image_pts, w, h)
+
+    def landmarks(self, rgb, roi):
+        """FaceMesh on rgb[roi] -> the 4 pose points in full-frame pixels, or None."""
+        x1, y1, x2, y2 = roi
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            return None
+        with metrics.timer("facemesh"):
+            # A view into the frame's shared RGB buffer (MediaPipe copies it into its own ImageFrame)
+            results = self.face_mesh.process(rgb[y1:y2, x1:x2])
+        self.mesh_runs += 1
+
+        if not results.multi_face_landmarks:
+            return None
 
         landmarks = results.multi_face_landmarks[0].landmark
-        
-        # Simplified Head Pose Estimation 
-        # Nose tip, Chin, Left Eye, Right Eye, Left Mouth, Right Mouth
-        image_pts = np.array([
-            [landmarks[1].x * w, landmarks[1].y * h],   # Nose
-            [landmarks[152].x * w, landmarks[152].y * h], # Chin
-            [landmarks[33].x * w, landmarks[33].y * h],   # L Eye
-            [landmarks[263].x * w, landmarks[263].y * h]  # R Eye
-        ], dtype="double")
-
-        # 3D model points
-        model_pts = np.array([(0.0, 0.0, 0.0), (0.0, -330.0, -65.0), (-225.0, 170.0, -135.0), (225.0, 170.0, -135.0)])
-        
-        focal_length = w
-        cam_matrix = np.array([[focal_length, 0, w/2], [0, focal_length, h/2], [0, 0, 1]], dtype="double")
-        
-        _, rvec, _ = cv2.solvePnP(model_pts, image_pts, cam_matrix, np.zeros((4,1)))
-        rmat, _ = cv2.Rodrigues(rvec)
-        angles, _, _, _, _, _ = cv2.decomposeProjectionMatrix(np.hstack((rmat, [[0],[0],[0]])))
-        
+        rw, rh = x2 - x1, y2 - y1
+        return np.array([[landmarks[i].x * rw + x1, landmarks[i].y * rh + y1] for i in POSE_LANDMARKS], dtype="double")
+
+    def pose(self, image_pts, w, h):
+        """Simplified Head Pose Estimation -> [gaze_offscreen, head_turned]"""
+        with metrics.timer("solvepnp"):
+            _, rvec, _ = cv2.solvePnP(MODEL_PTS, image_pts, self.cam_matrix(w, h), DIST_COEFFS)
+            rmat, _ = cv2.Rodrigues(rvec)
+            angles, _, _, _, _, _ = cv2.decomposeProjectionMatrix(np.hstack((rmat, [[0],[0],[0]])))
+
         pitch, yaw = angles[0][0], angles[1][0]
-        
+
         gaze_offscreen = 1.0 if abs(yaw) > self.YAW_THRESH else 0.0
         head_turned = 1.0 if abs(pitch) > self.PITCH_THRESH else 0.0
-        
-        return [gaze_offscreen, head_turned]
\ No newline at end of file
+
+        return [gaze_offscreen, head_turned]
+
+    def stats(self):
+        return {"mesh_runs": self.mesh_runs, "carried_frames": self.carried_frames}
@@ -1,36 +1,139 @@
-import cv2
+import os
 import numpy as np
-from fastapi import FastAPI, UploadFile, File
-from vision_module import VisionProcessor
-from gaze_module import GazeProcessor
+from fastapi import FastAPI, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse
+from vision_module import VisionProcessor, WINDOW_SIZE
+from gaze_module import GazeProcessor, GazeTrack
+from common.session_store import SessionStore, RingBuffer, DEFAULT_SESSION
+from common.frame_gate import FrameGate
+from preprocess import prepare, YOLO_INPUT_SIZE, GAZE_INPUT_SIZE
+from common.metrics import metrics, instrument
+from common.batching import MicroBatcher
+from common.workers import ModelPool, QueueFull
 
 app = FastAPI()
+instrument(app)  # /metrics
+
+# Workers per model; each worker owns its own YOLO / FaceMesh instance
+YOLO_WORKERS = int(os.getenv("YOLO_WORKERS", "1"))
+GAZE_WORKERS = int(os.getenv("GAZE_WORKERS", "2"))
+
+# Initialize processors once at startup (session histories are shared by all workers)
+sessions = SessionStore(lambda: RingBuffer(WINDOW_SIZE, 3, np.uint8))
+vision_pool = ModelPool(lambda: VisionProcessor(sessions), workers=YOLO_WORKERS, name="yolo")
+gaze_sessions = SessionStore(GazeTrack)
+gaze_pool = ModelPool(lambda: GazeProcessor(gaze_sessions), workers=GAZE_WORKERS, name="facemesh")
+vision_p = vision_pool.instances[0]  # for the cheap, model-free history update
+
+# Near-identical consecutive frames of a session reuse the last YOLO + FaceMesh output
+frame_gate = FrameGate()
+
+
+def detect_batch(vision, frames):
+    """One YOLO pass for frames collected from concurrent requests."""
+    return vision.detect_batch(frames)
+
+
+def gaze_face(gaze, frame, face_box, session_id):
+    # Runs on a gaze worker, so the frame's one BGR->RGB conversion happens off the event loop
+    return gaze.process_face(frame, face_box, session_id)
+
+
+batcher = MicroBatcher(detect_batch, vision_pool)
+
+# Queue depths and in-flight work, read on every /metrics scrape
+metrics.gauge("yolo_batch_pending", lambda: batcher.stats()["pending"])
+metrics.gauge("yolo_in_flight", lambda: vision_pool.in_flight)
+metrics.gauge("facemesh_in_flight", lambda: gaze_pool.in_flight)
+metrics.gauge("rejected", lambda: vision_pool.rejected + gaze_pool.rejected)
+metrics.gauge("sessions", lambda: len(sessions))
+
+
+@app.exception_handler(QueueFull)
+async def queue_full_handler(request: Request, exc: QueueFull):
+    return JSONResponse(status_code=503, content={"status": "queue_full", "message": str(exc)})
 
-# Initialize processors once at startup
-vision_p = VisionProcessor()
-gaze_p = GazeProcessor()
 
 @app.post("/process")
-async def process_vision(file: UploadFile = File(...)):
-    # Convert uploaded bytes to OpenCV frame
+async def process_vision(
+    file: UploadFile = File(...),
+    session_id: str = Form(DEFAULT_SESSION),
+    return_face: bool = Form(False),
+):
     contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    return await process_bytes(contents, session_id, return_face)
+
+
+@app.post("/process_raw")
+async def process_vision_raw(request: Request, session_id: str = DEFAULT_SESSION, return_face: bool = False):
+    """Same as /process, but the body is the raw JPEG (no multipart encoding). Used by the gateway."""
+    contents = await request.body()
+    return await process_bytes(contents, session_id, return_face)
+
+
+async def process_bytes(contents, session_id, return_face):
+    # Decode once (at reduced scale for large uploads); YOLO, the gate and FaceMesh share the buffers
+    frame = prepare(contents)
 
     if frame is None:
+        if return_face:
+            return {"features": [0.0, 0.0, 1.0, 1.0, 1.0], "face_box": None, "num_boxes": 0}
         return [0.0, 0.0, 1.0, 1.0, 1.0] # Fail-safe defaults
 
-    # Get results from Vision Module [phone, multi, missing]
-    # We modify the module's return slightly for production speed
-    vision_results = vision_p.process_frame(frame) 
-    
-    # Get results from Gaze Module [gaze_off, gaze_turn]
-    gaze_results = gaze_p.process_frame(frame)
+    # Gated frames count against the gaze track's refresh period too, and a due refresh skips the gate
+    gaze_track = gaze_sessions.get(session_id)
+    with metrics.timer("frame_gate"):
+        cached, thumb = frame_gate.check(session_id, frame.bgr, force=gaze_track.due())
+    if cached is not None:
+        # Scene unchanged since the last full pass: same detections, same gaze
+        gaze_track.tick()
+        boxes, gaze_results = cached
+        face_box, num_boxes = vision_p.face_detection(boxes)
+    else:
+        # YOLO first (batched with other concurrent requests); FaceMesh then only looks at the face it found
+        # (request-side timers include queueing; yolo_forward / facemesh / solvepnp are the pure compute)
+        with metrics.timer("yolo"):
+            boxes = (await batcher.submit(frame.bgr)).boxes
+        face_box, num_boxes = vision_p.face_detection(boxes)
+        with metrics.timer("gaze"):
+            gaze_results = await gaze_pool.submit(gaze_face, frame, face_box, session_id)
+        frame_gate.store(session_id, thumb, (boxes, gaze_results))
+
+    # Get results from Vision Module [phone, multi, missing] (the history advances on every frame)
+    vision_results = vision_p.update(boxes, session_id)
 
     # Return the exact 5-value list the Gateway expects
     # Order: phone, multi, missing, gaze_off, gaze_turn
-    return vision_results + gaze_results
+    features = vision_results + gaze_results
+    if not return_face:
+        return features
+
+    # Shared-detection mode: also hand the face box to the gateway so identity skips its YOLO pass
+    # (in the uploaded image's pixels: identity crops from its own full-size decode)
+    return {"features": features, "face_box": frame.to_source(face_box), "num_boxes": num_boxes}
+
+
+@app.get("/health")
+async def health():
+    """YOLO and FaceMesh are loaded before the server starts listening, so answering means ready."""
+    return {"status": "ready", "yolo_workers": vision_pool.workers, "gaze_workers": gaze_pool.workers,
+            "yolo_input_size": YOLO_INPUT_SIZE, "gaze_input_size": GAZE_INPUT_SIZE}
+
+
+@app.get("/batch_stats")
+async def batch_stats():
+    """Achieved micro-batch sizes (BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS tune them) and pool load."""
+    gaze = [g.stats() for g in gaze_pool.instances]
+    return {
+        **batcher.stats(),
+        "yolo_pool": vision_pool.stats(),
+        "gaze_pool": gaze_pool.stats(),
+        # FaceMesh calls vs frames answered from a stable head's previous landmarks
+        "gaze_mesh_runs": sum(g["mesh_runs"] for g in gaze),
+        "gaze_carried_frames": sum(g["carried_frames"] for g in gaze),
+        "frame_gate": frame_gate.stats(),
+    }
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,120 @@
+"""
+One preprocessing pass per uploaded frame, shared by every model in vision_service.
+
+The JPEG header says how big the frame is before anything is decoded. When it is at least twice
+the largest model input, libjpeg decodes straight to 1/2, 1/4 or 1/8 scale (IMREAD_REDUCED_*,
+the DCT does the downscaling, far cheaper than a full decode plus resize). The BGR frame goes to
+YOLO (which letterboxes it to YOLO_INPUT_SIZE) and to the frame gate. FaceMesh gets its own RGB
+buffer, shrunk to GAZE_INPUT_SIZE when the frame is larger and converted once per frame; the face
+ROIs are slices (views) of it.
+
+Target sizes are per model, so an exam can trade accuracy for throughput:
+    YOLO_INPUT_SIZE   YOLO inference size (letterbox side, multiple of 32). Static exports
+                      (YOLO_RUNTIME=torchscript) only run at the size they were exported at.
+    GAZE_INPUT_SIZE   long side of the RGB frame FaceMesh crops its face ROI from (independent
+                      of YOLO_INPUT_SIZE; the decode keeps enough pixels for the larger of the two)
+"""
+import os
+import struct
+import cv2
+import numpy as np
+from common.metrics import metrics
+
+YOLO_INPUT_SIZE = int(os.getenv("YOLO_INPUT_SIZE", "640"))
+GAZE_INPUT_SIZE = int(os.getenv("GAZE_INPUT_SIZE", "640"))
+
+# reduction factor -> imdecode flag, largest first
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# Start-of-frame markers carrying the image size (C4/C8/CC are DHT/JPG/DAC, not frames)
+SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpeg_size(data):
+    """(width, height) from the JPEG header without decoding, or None for anything else."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    i, n = 2, len(data)
+    while i + 9 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:  # markers without a length
+            i += 2
+            continue
+        i += 2 + struct.unpack(">H", data[i + 2:i + 4])[0]
+    return None
+
+
+def reduction_for(size, target):
+    """Largest JPEG decode reduction that keeps the long side at or above target."""
+    if size is None:
+        return 1
+    long_side = max(size)
+    for factor, _ in REDUCED_FLAGS:
+        if long_side // factor >= target:
+            return factor
+    return 1
+
+
+class PreparedFrame:
+    """
+    A decoded frame and the buffers derived from it. `scale` maps coordinates in `bgr` back to
+    the uploaded image (identity_service crops from its own full-size decode); `gaze_scale` maps
+    them into `rgb`, the FaceMesh buffer.
+    """
+
+    def __init__(self, bgr, scale=1.0, gaze_size=GAZE_INPUT_SIZE):
+        self.bgr = bgr
+        self.scale = scale
+        h, w = bgr.shape[:2]
+        self.gaze_scale = min(1.0, gaze_size / max(h, w))
+        self.gaze_shape = (round(h * self.gaze_scale), round(w * self.gaze_scale), 3)
+        self._rgb = None
+
+    @property
+    def shape(self):
+        return self.bgr.shape
+
+    @property
+    def rgb(self):
+        """RGB frame at the gaze input size (gaze_shape), built on first use and then shared."""
+        if self._rgb is None:
+            small = self.bgr
+            if self.gaze_scale < 1.0:
+                h, w, _ = self.gaze_shape
+                small = cv2.resize(self.bgr, (w, h), interpolation=cv2.INTER_AREA)
+            self._rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    def to_gaze(self, box):
+        """[x1, y1, x2, y2] in `bgr` -> the same box in `rgb`."""
+        if box is None or self.gaze_scale == 1.0:
+            return box
+        return [int(v * self.gaze_scale) for v in box]
+
+    def to_source(self, box):
+        """[x1, y1, x2, y2] in this frame -> the same box in the uploaded image's pixels."""
+        if box is None or self.scale == 1.0:
+            return box
+        return [int(v * self.scale) for v in box]
+
+
+def prepare(data, target=None):
+    """Encoded image bytes -> PreparedFrame (decoded at reduced scale when possible), or None."""
+    if target is None:
+        target = max(YOLO_INPUT_SIZE, GAZE_INPUT_SIZE)
+    size = jpeg_size(data)
+    factor = reduction_for(size, target)
+    with metrics.timer("decode"):
+        bgr = cv2.imdecode(np.frombuffer(data, np.uint8), dict(REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR))
+    if bgr is None:
+        return None
+    # Reduced decodes round odd sizes up, so the exact ratio comes from the header
+    scale = size[0] / bgr.shape[1] if factor > 1 else 1.0
+    return PreparedFrame(bgr, scale)
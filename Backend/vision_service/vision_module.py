@@ -1,18 +1,20 @@
-import collections
-from ultralytics import YOLO
+import numpy as np
+from common.model_runtime import load_yolo, YOLO_PREDICT_ARGS
+from common.session_store import SessionStore, RingBuffer, DEFAULT_SESSION
+from common.metrics import metrics
+from preprocess import YOLO_INPUT_SIZE
 
 
 model_path = "weights/best.pt"
+WINDOW_SIZE = 10  # frames per session history
 
 class VisionProcessor:
-    def __init__(self):
-        self.model = YOLO(model_path)
-        self.window_size = 10
-        self.history = {
-            "phone": collections.deque(maxlen=self.window_size),
-            "multi_person": collections.deque(maxlen=self.window_size),
-            "face_missing": collections.deque(maxlen=self.window_size)
-        }
+    def __init__(self, sessions=None, imgsz=YOLO_INPUT_SIZE):
+        self.model = load_yolo(model_path)  # eager / torchscript / onnx, per YOLO_RUNTIME
+        self.imgsz = imgsz  # letterbox size YOLO runs at
+        self.window_size = WINDOW_SIZE
+        # Per-session history, one row per frame: [phone, multi_person, face_missing]
+        self.sessions = sessions if sessions is not None else SessionStore(lambda: RingBuffer(self.window_size, 3, np.uint8))
         # Automatically map Class IDs
         names = self.model.names
         self.PHONE_CLS = next(k for k, v in names.items() if v == "prohibited_device")
@@ -20,25 +22,41 @@ class VisionProcessor:
         self.FACE_CLS = next(k for k, v in names.items() if v == "face")
 
 
-    def process_frame(self, frame, return_visuals=False):
-        results = self.model(frame, verbose=False)
-        result = results[0] # Keep the full result object for plotting
-        detected = results[0].boxes.cls.cpu().numpy().astype(int).tolist()
-        
-        # Binary flags for current frame
-        self.history["phone"].append(1 if self.PHONE_CLS in detected else 0)
-        self.history["multi_person"].append(1 if detected.count(self.PERSON_CLS) >= 2 else 0)
-        self.history["face_missing"].append(1 if self.FACE_CLS not in detected else 0)
-
-        # Calculate Ratios
-        # Using max(1, len) to avoid division by zero errors
-        ratios = [
-            sum(self.history["phone"]) / len(self.history["phone"]),
-            sum(self.history["multi_person"]) / len(self.history["multi_person"]),
-            sum(self.history["face_missing"]) / len(self.history["face_missing"])
-        ]
+    def process_frame(self, frame, session_id=DEFAULT_SESSION, return_visuals=False):
+        result = self.detect(frame) # Keep the full result object for plotting
+        ratios = self.update(result.boxes, session_id)
     
         if return_visuals:
             return ratios, result.plot() 
         
-        return ratios
\ No newline at end of file
+        return ratios
+
+    def detect(self, frame):
+        return self.detect_batch([frame])[0]
+
+    def detect_batch(self, frames):
+        """One YOLO forward pass over a list of frames (used by the micro-batcher)."""
+        with metrics.timer("yolo_forward"):
+            return self.model(frames, imgsz=self.imgsz, **YOLO_PREDICT_ARGS)
+
+    def update(self, boxes, session_id=DEFAULT_SESSION):
+        """Appends this frame's flags (from a result's boxes) to the session window and returns [phone, multi, missing] ratios."""
+        detected = boxes.cls.cpu().numpy().astype(int).tolist()
+        
+        # Binary flags for current frame
+        history = self.sessions.get(session_id)
+        history.append((
+            1 if self.PHONE_CLS in detected else 0,
+            1 if detected.count(self.PERSON_CLS) >= 2 else 0,
+            1 if self.FACE_CLS not in detected else 0,
+        ))
+
+        # Calculate Ratios [phone, multi_person, face_missing] over the session window
+        return [float(r) for r in history.mean()]
+
+    def face_detection(self, boxes):
+        """(face_box, num_boxes) in the form identity_service accepts, so it can skip its own YOLO pass."""
+        for cls, xyxy in zip(boxes.cls.cpu().numpy().astype(int), boxes.xyxy.cpu().numpy()):
+            if cls == self.FACE_CLS:
+                return xyxy.astype(int).tolist(), len(boxes) # first = most confident face
+        return None, len(boxes)
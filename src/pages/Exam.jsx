@@ -2,6 +2,8 @@ import { useState, useEffect, useRef } from "react";
 
 // Use the environment variable for the Gateway URL
 const apiURL = import.meta.env.VITE_API_URL_GATEWAY;
+// Optional streaming endpoint (e.g. ws://localhost:8000/ws); falls back to POST when unset
+const wsURL = import.meta.env.VITE_WS_URL_GATEWAY;
 
 const QUESTIONS = [
   {
@@ -75,6 +77,9 @@ export default function Exam() {
   const [riskScore, setRiskScore] = useState(0);
   const [violationMsg, setViolationMsg] = useState("");
   const [isCapturing, setIsCapturing] = useState(false);
+  // One id per exam attempt so the backend keeps this candidate's history separate
+  const sessionIdRef = useRef(crypto.randomUUID());
+  const socketRef = useRef(null);
 
   /* ================= PERMISSION CHECK ================= */
   const requestPermissions = async () => {
@@ -91,6 +96,36 @@ export default function Exam() {
     }
   };
 
+  const handleVerdict = (data) => {
+    setRiskScore(data.risk_score); // Update HUD
+    setViolationMsg(data.message); // Update HUD Warning
+
+    if (data.status === "AUTO_FAIL") {
+      alert(`CRITICAL VIOLATION: ${data.message}. Exam Terminated.`);
+      setSubmitted(true);
+    }
+  };
+
+  /* ================= PROCTORING STREAM ================= */
+  // One persistent socket per exam: binary JPEG frames out, verdict JSON back
+  useEffect(() => {
+    if (!wsURL || !permissionsGranted || submitted) return;
+
+    const socket = new WebSocket(`${wsURL}/${sessionIdRef.current}`);
+    socket.binaryType = "arraybuffer";
+    socket.onmessage = (event) => {
+      handleVerdict(JSON.parse(event.data));
+      setIsCapturing(false);
+    };
+    socket.onclose = () => setIsCapturing(false);
+    socketRef.current = socket;
+
+    return () => {
+      socketRef.current = null;
+      socket.close();
+    };
+  }, [permissionsGranted, submitted]);
+
   /* ================= PROCTORING INFERENCE LOOP ================= */
   useEffect(() => {
     if (!permissionsGranted || submitted) return;
@@ -107,8 +142,15 @@ export default function Exam() {
 
       canvas.toBlob(
         async (blob) => {
+          const socket = socketRef.current;
+          if (socket && socket.readyState === WebSocket.OPEN) {
+            socket.send(blob); // the verdict arrives in socket.onmessage
+            return;
+          }
+
           const formData = new FormData();
           formData.append("file", blob, "frame.jpg");
+          formData.append("session_id", sessionIdRef.current);
 
           try {
             // Fix: Call the correct endpoint on the gateway
@@ -117,15 +159,7 @@ export default function Exam() {
               body: formData,
             });
 
-            const data = await response.json();
-
-            setRiskScore(data.risk_score); // Update HUD
-            setViolationMsg(data.message); // Update HUD Warning
-
-            if (data.status === "AUTO_FAIL") {
-              alert(`CRITICAL VIOLATION: ${data.message}. Exam Terminated.`);
-              setSubmitted(true);
-            }
+            handleVerdict(await response.json());
           } catch (err) {
             console.error("Proctoring API unreachable:", err);
           } finally {
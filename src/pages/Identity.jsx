@@ -12,6 +12,7 @@ function Identity() {
   const [cameraOn, setCameraOn] = useState(false);
   const [count, setCount] = useState(0);
   const [isScanning, setIsScanning] = useState(false);
+  const [feedback, setFeedback] = useState("");
 
   const totalImages = 15;
   const navigate = useNavigate();
@@ -75,21 +76,45 @@ function Identity() {
       formData.append("files", blob, `img_${nextCount}.jpg`);
 
       try {
-        await fetch(`${apiURL}/enroll`, {
+        const res = await fetch(`${apiURL}/enroll`, {
           method: "POST",
           mode: "cors",
           body: formData,
         });
+        const body = await res.json().catch(() => ({}));
+        const [image] = body.images || [];
+        if (!res.ok || !image || !image.accepted) {
+          // Rejected by the quality gate, or the upload failed: the shot doesn't count, retake it
+          setCount((c) => c - 1);
+          const detail = typeof body.detail === "string" ? body.detail : body.message;
+          setFeedback(`Retake: ${image?.reason || detail || "upload failed"}`);
+          return;
+        }
+        setFeedback("");
       } catch (err) {
         console.error("Upload error:", err);
+        setCount((c) => c - 1);
+        setFeedback("Retake: upload failed");
+        return;
       }
 
       if (nextCount === totalImages) {
         try {
           const trainRes = await fetch(`${apiURL}/train`, { method: "POST" });
-          if (trainRes.ok) {
+          const { job_id } = await trainRes.json();
+
+          // Training runs in the background; poll until it finishes
+          let job = { status: "queued" };
+          while (job.status === "queued" || job.status === "running") {
+            await new Promise((resolve) => setTimeout(resolve, 2000));
+            job = await (await fetch(`${apiURL}/train/${job_id}`)).json();
+          }
+
+          if (job.status === "succeeded") {
             alert("Your Identity has been recorded!"); // Enrollment and Training Complete!
             navigate("/");
+          } else {
+            alert("An Error Occured, Reload and retake photos");
           }
         } catch {
           alert("An Error Occured, Reload and retake photos"); // Training must've started, Check backend console for progress.
@@ -219,6 +244,11 @@ function Identity() {
               </p>
             )}
           </div>
+          {feedback && (
+            <p className="text-red-400 font-mono text-sm tracking-wider mb-4">
+              {feedback}
+            </p>
+          )}
 
           {!cameraOn ? (
             <button